@@ -0,0 +1,125 @@
+"""
+Benchmarks of the setup phases and the run of the NEURON adapter on synthetic networks,
+parametrized by the size of the network and the number of ranks. The setup phases are
+measured by the setup profile of the simulation.
+"""
+
+from bsb.simulation import get_simulation_adapter
+from patch import p
+
+from .network import add_simulation, get_network, simulated_ranks
+
+
+def _unit(unit):
+    def decorator(f):
+        f.unit = unit
+        return f
+
+    return decorator
+
+
+class _AdapterBenchmark:
+    params = ([1000, 4000], [10, 100], [1, 8], [1, 4])
+    param_names = ["cells", "connections_per_cell", "chunks", "ranks"]
+    timeout = 600
+    model = "arborize"
+
+    def setup(self, cells, connections_per_cell, chunks, ranks):
+        p.parallel.gid_clear()
+        self.ranks = ranks
+        network = get_network(cells, connections_per_cell, chunks)
+        self.simulation = add_simulation(network, self.model)
+        self.adapter = get_simulation_adapter("neuron")
+        with simulated_ranks(ranks):
+            simdata = self.adapter.prepare(self.simulation)
+        (self.profile,) = simdata.result.setup_profile
+
+    def teardown(self, *params):
+        self.adapter.simdata.pop(self.simulation, None)
+
+    def _timing(self, phase):
+        return self.profile["timings"][phase]
+
+    def _memory(self, phase):
+        return self.profile["memory"][phase]
+
+
+class Setup(_AdapterBenchmark):
+    """
+    Time and raise of the peak memory of each phase of the setup. Allocating the
+    transmitters includes mapping the transceivers.
+    """
+
+    @_unit("seconds")
+    def track_time_load_balancing(self, *params):
+        return self._timing("load_balancing")
+
+    @_unit("seconds")
+    def track_time_create_neurons(self, *params):
+        return self._timing("create_neurons")
+
+    @_unit("seconds")
+    def track_time_allocate_transmitters(self, *params):
+        return self._timing("allocate_transmitters")
+
+    @_unit("seconds")
+    def track_time_create_connections(self, *params):
+        return self._timing("create_connections")
+
+    @_unit("seconds")
+    def track_time_create_devices(self, *params):
+        return self._timing("create_devices")
+
+    @_unit("MB")
+    def track_memory_create_neurons(self, *params):
+        return self._memory("create_neurons")
+
+    @_unit("MB")
+    def track_memory_allocate_transmitters(self, *params):
+        return self._memory("allocate_transmitters")
+
+    @_unit("MB")
+    def track_memory_create_connections(self, *params):
+        return self._memory("create_connections")
+
+    @_unit("MB")
+    def track_memory_create_devices(self, *params):
+        return self._memory("create_devices")
+
+
+class ShimSetup(_AdapterBenchmark):
+    """
+    Time and raise of the peak memory of creating cells without NEURON objects, which
+    measures the overhead of the adapter itself.
+    """
+
+    params = ([1000, 10000], [1], [1, 8], [1, 4])
+    model = "shim"
+
+    @_unit("seconds")
+    def track_time_create_neurons(self, *params):
+        return self._timing("create_neurons")
+
+    @_unit("MB")
+    def track_memory_create_neurons(self, *params):
+        return self._memory("create_neurons")
+
+
+class Run(_AdapterBenchmark):
+    """
+    Time and peak memory of running a prepared network for 100ms. The peak memory
+    includes the setup.
+    """
+
+    # Each run consumes the prepared network, so every sample needs its own setup.
+    number = 1
+    repeat = (1, 5, 60.0)
+    warmup_time = 0
+
+    def time_run(self, *params):
+        with simulated_ranks(self.ranks):
+            self.adapter.run(self.simulation)
+
+    def peakmem_run(self, *params):
+        with simulated_ranks(self.ranks):
+            self.adapter.run(self.simulation)
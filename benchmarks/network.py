@@ -0,0 +1,174 @@
+"""
+Synthetic networks to benchmark the adapter on. The networks are built once per set of
+parameters, and stored in the temporary directory.
+"""
+
+import contextlib
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+from bsb import MPI, Branch, Configuration, Morphology, Scaffold, Storage, config
+from bsb.connectivity import FixedIndegree
+
+from bsb_neuron.cell import ArborizedModel, ShimModel
+from bsb_neuron.connection import TransceiverModel
+
+HH_SOMA = {
+    "cable_types": {
+        "soma": {
+            "cable": {"Ra": 10, "cm": 1},
+            "mechanisms": {"pas": {}, "hh": {}},
+        }
+    },
+    "synapse_types": {"ExpSyn": {}},
+}
+
+
+@config.node
+class SomaticIndegree(FixedIndegree):
+    """
+    Connect each postsynaptic cell to ``indegree`` random presynaptic cells, from soma to
+    soma.
+    """
+
+    def connect_cells(self, pre_set, post_set, src_locs, dest_locs, tag=None):
+        src_locs[:, 1:] = 0
+        dest_locs[:, 1:] = 0
+        super().connect_cells(pre_set, post_set, src_locs, dest_locs, tag=tag)
+
+
+def get_network(cells, connections_per_cell, chunks):
+    """
+    Get a network of ``cells`` cells, half of type A and half of type B, spread over a
+    row of ``chunks`` chunks. A and B connect to each other with
+    ``connections_per_cell`` connections per postsynaptic cell.
+    """
+    root = os.path.join(
+        tempfile.gettempdir(),
+        "bsb_neuron_benchmarks",
+        f"network_{cells}_{connections_per_cell}_{chunks}.hdf5",
+    )
+    if not os.path.exists(root):
+        # Build the network under another name, so that interrupted builds are redone.
+        os.makedirs(os.path.dirname(root), exist_ok=True)
+        building = f"{root}.{os.getpid()}"
+        network = Scaffold(
+            Configuration.default(**_tree(cells, connections_per_cell, chunks)),
+            Storage("hdf5", building),
+        )
+        network.morphologies.save("soma", _soma())
+        network.compile(clear=True)
+        os.replace(building, root)
+    return Scaffold(storage=Storage("hdf5", root))
+
+
+def add_simulation(network, model="arborize"):
+    """
+    Add the ``bench`` simulation to the network. Its setup is profiled. The ``shim``
+    model only creates the cells; the ``arborize`` model creates single compartment HH
+    cells, connects them with ExpSyn synapses and adds devices.
+    """
+    if model == "shim":
+        cell_models = dict(A=ShimModel(), B=ShimModel())
+        connection_models = {}
+        devices = {}
+    else:
+        cell_models = dict(
+            A=ArborizedModel(model=HH_SOMA), B=ArborizedModel(model=HH_SOMA)
+        )
+        connection_models = dict(
+            A_to_B=TransceiverModel(synapses=[dict(synapse="ExpSyn", delay=1)]),
+            B_to_A=TransceiverModel(synapses=[dict(synapse="ExpSyn", delay=1)]),
+        )
+        devices = dict(
+            noise=dict(
+                device="spike_generator",
+                targetting={"strategy": "cell_model", "cell_models": ["A"]},
+                synapses=["ExpSyn"],
+                pattern=dict(type="poisson", rate=20),
+                weight=0.01,
+                delay=1,
+            ),
+            spikes=dict(
+                device="spike_recorder",
+                targetting={"strategy": "cell_model", "cell_models": ["A", "B"]},
+            ),
+            vrec=dict(
+                device="voltage_recorder",
+                targetting={"strategy": "cell_model", "cell_models": ["B"]},
+            ),
+        )
+    network.simulations.add(
+        "bench",
+        simulator="neuron",
+        duration=100,
+        resolution=0.1,
+        temperature=32,
+        seed=1,
+        profiling={},
+        cell_models=cell_models,
+        connection_models=connection_models,
+        devices=devices,
+    )
+    return network.simulations.bench
+
+
+@contextlib.contextmanager
+def simulated_ranks(size):
+    """
+    Set up and run the network in this process as the first of ``size`` ranks, with the
+    chunks that the load balancing assigns to it.
+    """
+    if size == 1:
+        yield
+        return
+    with mock.patch.object(MPI, "get_size", return_value=size), mock.patch.object(
+        MPI, "get_rank", return_value=0
+    ):
+        yield
+
+
+def _tree(cells, connections_per_cell, chunks):
+    rng = np.random.default_rng(0)
+    size = np.array([100.0 * chunks, 100.0, 100.0])
+    return {
+        "storage": {"engine": "hdf5"},
+        "network": {
+            "x": size[0],
+            "y": size[1],
+            "z": size[2],
+            "chunk_size": [100, 100, 100],
+        },
+        "partitions": {},
+        "cell_types": {
+            name: {"spatial": {"radius": 1, "count": 1, "morphologies": ["soma"]}}
+            for name in ("A", "B")
+        },
+        "placement": {
+            f"place_{name}": {
+                "strategy": "bsb.placement.FixedPositions",
+                "cell_types": [name],
+                "partitions": [],
+                "positions": rng.uniform(0, size, (cells // 2, 3)).tolist(),
+            }
+            for name in ("A", "B")
+        },
+        "connectivity": {
+            f"{pre}_to_{post}": {
+                "strategy": f"{__name__}.SomaticIndegree",
+                "indegree": connections_per_cell,
+                "presynaptic": {"cell_types": [pre]},
+                "postsynaptic": {"cell_types": [post]},
+            }
+            for pre, post in (("A", "B"), ("B", "A"))
+        },
+        "simulations": {},
+    }
+
+
+def _soma():
+    branch = Branch(np.array([[0.0, 0.0, 0.0], [0.0, 10.0, 0.0]]), np.array([5.0, 5.0]))
+    branch.label(["soma"])
+    return Morphology([branch])
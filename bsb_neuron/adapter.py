@@ -1,6 +1,12 @@
 import contextlib
+import hashlib
+import heapq
 import itertools
+import json
+import os
+import tempfile
 import typing
+from collections.abc import Sequence
 
 import numpy as np
 from bsb import (
@@ -14,9 +20,14 @@ from bsb import (
     SimulationResult,
     SimulatorAdapter,
     report,
+    warn,
 )
 from neo import AnalogSignal
 
+from .balancing import report_allocation
+from .profiling import SetupProfile, report_profile
+from .seeding import RandomStreams
+
 if typing.TYPE_CHECKING:
     from bsb import Simulation
 
@@ -28,24 +39,210 @@ class NeuronSimulationData(SimulationData):
         super().__init__(simulation, result=result)
         self.cid_offsets = dict()
         self.connections = dict()
+        self.source_ids = dict()
+        self.streams = None
+        self.profile = SetupProfile(simulation)
 
 
 class NeuronResult(SimulationResult):
-    def record(self, obj, **annotations):
+    def __init__(self, simulation):
+        super().__init__(simulation)
+        self._vectors = []
+        self._store = None
+        self._stored = None
+        self._channels = {}
+        self._variable_step = simulation.cvode is not None
+        self._coreneuron = simulation.coreneuron
+        # Time at which the recordings restarted, after a restored state.
+        self._t_restart = 0.0
+        # Timings and counts of the setup of each rank, if the setup was profiled.
+        self.setup_profile = None
+
+    def record(
+        self,
+        obj,
+        channel=None,
+        sampling_interval=None,
+        start=None,
+        stop=None,
+        **annotations,
+    ):
+        """
+        Record a NEURON variable.
+
+        :param obj: Pointer to the variable to record.
+        :param channel: Annotations of this variable. If given, all the variables with
+          the same annotations are flushed as the channels of 1 signal, with the
+          channel annotations as its array annotations.
+        :type channel: dict
+        :param sampling_interval: Time between samples, in ms. Defaults to every time
+          step.
+        :type sampling_interval: float
+        :param start: Time of the first sample, in ms.
+        :type start: float
+        :param stop: Time of the last sample, in ms.
+        :type stop: float
+        """
         from patch import p
-        from quantities import ms
 
-        v = p.record(obj)
+        period = sampling_interval or p.dt
+        t_start = start or 0.0
+        # Samples of the recorded data to keep.
+        samples = slice(None)
+        if self._coreneuron:
+            # CoreNEURON can only record every time step, so the samples are picked out
+            # afterwards.
+            v = p.Vector()
+            v.record(obj)
+            times = None
+            samples = slice(
+                round(t_start / p.dt),
+                None if stop is None else round(stop / p.dt) + 1,
+                max(1, round(period / p.dt)),
+            )
+        elif start is None and stop is None:
+            v = p.Vector()
+            if sampling_interval is None and not self._variable_step:
+                v.record(obj)
+            else:
+                v.record(obj, period)
+            times = None
+        else:
+            t_stop = p.tstop if stop is None else stop
+            times = p.Vector(np.arange(t_start, t_stop + period / 2, period))
+            v = p.Vector()
+            v.record(obj, times.__neuron__())
+        # Locations of the blocks of this vector that were drained to the store.
+        blocks = []
+        # Vectors recorded at the times of a time vector can't be drained: NEURON keeps
+        # writing at the index of the next sample time, so they are kept in memory.
+        self._vectors.append((v, blocks, times))
+        timebase = (period, t_start, times is not None)
+        if channel is not None:
+            self._add_channel(v, blocks, samples, channel, timebase, annotations)
+            return
 
         def flush(segment):
             if "units" not in annotations.keys():
                 annotations["units"] = "mV"
             segment.analogsignals.append(
-                AnalogSignal(list(v), sampling_period=p.dt * ms, **annotations)
+                AnalogSignal(
+                    self._collect(v, blocks)[samples],
+                    **self._timebase(*timebase),
+                    **annotations,
+                )
             )
 
         self.create_recorder(flush)
 
+    def _add_channel(self, v, blocks, samples, channel, timebase, annotations):
+        annotations.setdefault("units", "mV")
+        key = (
+            tuple(sorted(annotations.items(), key=lambda item: item[0])),
+            timebase,
+        )
+        try:
+            channels = self._channels[key]
+        except KeyError:
+            channels = self._channels[key] = []
+
+            def flush(segment):
+                data = None
+                for i, (vector, vector_blocks, vector_samples, _) in enumerate(channels):
+                    signal = self._collect(vector, vector_blocks)[vector_samples]
+                    if data is None:
+                        data = np.empty((len(signal), len(channels)), dtype=signal.dtype)
+                    data[:, i] = signal
+                array_annotations = {
+                    k: np.array([annotations[k] for *_, annotations in channels])
+                    for k in channels[0][-1].keys()
+                }
+                segment.analogsignals.append(
+                    AnalogSignal(
+                        data,
+                        array_annotations=array_annotations,
+                        **self._timebase(*timebase),
+                        **annotations,
+                    )
+                )
+
+            self.create_recorder(flush)
+        channels.append((v, blocks, samples, channel))
+
+    def restart(self, t):
+        """
+        Let the recordings start at time ``t``, for runs resumed from a saved state.
+        """
+        self._t_restart = t
+
+    def _timebase(self, period, t_start, windowed):
+        from quantities import ms
+
+        if self._t_restart > t_start:
+            if windowed:
+                # The first sample time of the window after the restart
+                skipped = np.ceil((self._t_restart - t_start) / period - 1e-9)
+                t_start += skipped * period
+            else:
+                t_start = self._t_restart
+        return dict(sampling_period=period * ms, t_start=t_start * ms)
+
+    def close(self):
+        """
+        Stop recording, so that running the network again doesn't overwrite the data.
+        """
+        from patch import p
+
+        cvode = p.CVode()
+        for v, *_ in self._vectors:
+            cvode.record_remove(v.__neuron__())
+
+    def stream(self, path):
+        """
+        Store the recorded data in the file at ``path`` each time :meth:`drain` is called,
+        instead of keeping it in memory for the whole simulation.
+        """
+        self._store = open(path, "w+b")
+
+    def drain(self):
+        """
+        Move the data recorded so far from the NEURON vectors to the store.
+        """
+        if self._store is None:
+            return
+        self._stored = None
+        for v, blocks, times in self._vectors:
+            if times is not None:
+                continue
+            data = v.as_numpy()
+            if len(data):
+                blocks.append((self._store.tell() // data.itemsize, len(data)))
+                data.tofile(self._store)
+                # Recording continues at the start of the emptied vector.
+                v.resize(0)
+
+    def flush(self):
+        try:
+            super().flush()
+        finally:
+            if self._store is not None:
+                self._stored = None
+                self._store.close()
+                os.remove(self._store.name)
+                self._store = None
+
+    def _collect(self, v, blocks):
+        # Copy the vector data, so that it can't be overwritten by NEURON afterwards.
+        data = v.as_numpy().copy()
+        if not blocks:
+            return data
+        if self._stored is None:
+            self._store.flush()
+            self._stored = np.memmap(self._store, dtype=data.dtype, mode="r")
+        return np.concatenate(
+            [self._stored[start : start + length] for start, length in blocks] + [data]
+        )
+
 
 @contextlib.contextmanager
 def fill_parameter_data(parameters, data):
@@ -73,33 +270,76 @@ class NeuronAdapter(SimulatorAdapter):
         return engine
 
     def prepare(self, simulation, comm=None):
-        self.simdata[simulation] = NeuronSimulationData(
+        simdata = self.simdata[simulation] = NeuronSimulationData(
             simulation, result=NeuronResult(simulation)
         )
+        profile = simdata.profile
         try:
+            profile.start()
             report("Preparing simulation", level=2)
             self.engine.dt = simulation.resolution
             self.engine.celsius = simulation.temperature
             self.engine.tstop = simulation.duration
+            simdata.streams = RandomStreams.from_simulation(simulation)
+            simdata.streams.install()
             report("Load balancing", level=2)
-            self.load_balance(simulation)
+            with profile.phase("load_balancing"):
+                self.load_balance(simulation)
             report("Creating neurons", level=2)
-            self.create_neurons(simulation)
+            with profile.phase("create_neurons"):
+                self.create_neurons(simulation)
             report("Creating transmitters", level=2)
-            self.create_connections(simulation)
-            report("Creating devices", level=2)
-            self.create_devices(simulation)
-            return self.simdata[simulation]
+            with profile.phase("create_connections"):
+                self.create_connections(simulation)
+            with profile.phase("seed_cells"):
+                simdata.streams.seed_cells(simdata.populations)
+            self._prepare_devices(simulation)
+            profile.stop()
+            if profile.enabled:
+                self._report_profile(simdata)
+            return simdata
         except:
+            profile.stop()
             del self.simdata[simulation]
             raise
 
+    def _report_profile(self, simdata):
+        simdata.profile.count(simdata)
+        ranks = simdata.profile.gather()
+        report("Setup profile:", level=2)
+        report_profile(ranks)
+        simdata.result.setup_profile = ranks
+
+    def _prepare_devices(self, simulation):
+        if simulation.flush_interval:
+            if simulation.coreneuron:
+                warn("CoreNEURON recordings can't be flushed during the simulation.")
+            else:
+                self._stream_result(simulation)
+        profile = self.simdata[simulation].profile
+        # Recorders only sample correctly if the solver is set up before them.
+        with profile.phase("configure_solver"):
+            self.configure_solver(simulation)
+        report("Creating devices", level=2)
+        with profile.phase("create_devices"):
+            self.create_devices(simulation)
+
+    def _stream_result(self, simulation):
+        fd, path = tempfile.mkstemp(
+            prefix=f"bsb_neuron_{simulation.name}_{MPI.get_rank()}_",
+            suffix=".dat",
+            dir=simulation.flush_directory,
+        )
+        os.close(fd)
+        self.simdata[simulation].result.stream(path)
+
     def load_balance(self, simulation):
         simdata = self.simdata[simulation]
-        chunk_stats = simulation.scaffold.storage.get_chunk_stats()
         size = MPI.get_size()
-        all_chunks = [Chunk.from_id(int(chunk), None) for chunk in chunk_stats.keys()]
-        simdata.node_chunk_alloc = [all_chunks[rank::size] for rank in range(0, size)]
+        simdata.node_chunk_alloc, simdata.predicted_load = (
+            simulation.load_balancing.allocate(simulation, size)
+        )
+        report_allocation(simdata.node_chunk_alloc, simdata.predicted_load)
         simdata.chunk_node_map = {}
         for node, chunks in enumerate(simdata.node_chunk_alloc):
             for chunk in chunks:
@@ -110,38 +350,286 @@ class NeuronAdapter(SimulatorAdapter):
             for model in simulation.cell_models.values()
         }
 
-    def run(self, *simulations: "Simulation"):
+    def run(self, *simulations: "Simulation", keep_network=False):
+        """
+        Run the prepared simulations.
+
+        :param keep_network: Keep the cells and connections after the run, to
+          :meth:`rerun` the simulations with other devices.
+        :type keep_network: bool
+        """
         unprepared = [sim for sim in simulations if sim not in self.simdata]
         if unprepared:
             raise AdapterError(f"Unprepared for simulations: {', '.join(unprepared)}")
+        if any(
+            sim.coreneuron and (sim.checkpoint_interval or sim.restore_from)
+            for sim in simulations
+        ):
+            raise AdapterError("CoreNEURON runs can't be checkpointed or restored.")
+        restore_from = next(
+            (sim.restore_from for sim in simulations if sim.restore_from), None
+        )
         try:
+            if restore_from is not None:
+                # Fail before the network is initialized.
+                self._check_checkpoint(restore_from)
             report("Simulating...", level=2)
             pc = self.engine.ParallelContext()
-            pc.set_maxstep(10)
-            self.engine.finitialize(self.initial)
             duration = max(sim.duration for sim in simulations)
+            self._compress_spikes(pc, simulations)
+            maxstep = min(
+                (sim.maxstep for sim in simulations if sim.maxstep), default=duration
+            )
+            maxstep = self._initialize(pc, maxstep)
+            # `set_maxstep` returns the minimum delay of the connections this rank
+            # receives.
+            report(f"Exchanging spikes every {pc.allreduce(maxstep, 3)}ms", level=3)
+            t_restored = 0.0
+            if restore_from is not None:
+                t_restored = self.restore_state(restore_from)
+                for sim in simulations:
+                    self.simdata[sim].result.restart(t_restored)
             progress = AdapterProgress(duration)
-            for oi, i in progress.steps(step=1):
+            # CoreNEURON copies the model each time it is solved, so it is solved at once.
+            interval = min(
+                sim.duration if sim.coreneuron else (sim.psolve_interval or sim.duration)
+                for sim in simulations
+            )
+            drains = {
+                sim: sim.flush_interval for sim in simulations if sim.flush_interval
+            }
+            checkpoints = {
+                sim: (t_restored // sim.checkpoint_interval + 1) * sim.checkpoint_interval
+                for sim in simulations
+                if sim.checkpoint_interval
+            }
+            progress_interval = min(
+                (sim.progress_interval for sim in simulations if sim.progress_interval),
+                default=0,
+            )
+            next_progress = progress_interval
+            for oi, i in progress.steps(step=interval):
+                if i <= t_restored:
+                    continue
                 pc.psolve(i)
-                tick = progress.tick(i)
-                for listener in self._progress_listeners:
-                    listener(simulations, tick)
+                for sim, next_drain in drains.items():
+                    if i >= next_drain:
+                        self.simdata[sim].result.drain()
+                        drains[sim] = next_drain + sim.flush_interval
+                for sim, next_checkpoint in checkpoints.items():
+                    if i >= next_checkpoint:
+                        self.save_state(
+                            os.path.join(sim.checkpoint_directory, f"{sim.name}_{i:g}ms")
+                        )
+                        checkpoints[sim] = next_checkpoint + sim.checkpoint_interval
+                if i >= next_progress or i >= duration:
+                    next_progress += progress_interval
+                    tick = progress.tick(i)
+                    for listener in self._progress_listeners:
+                        listener(simulations, tick)
             progress.complete()
             report("Finished simulation.", level=2)
         finally:
             results = [self.simdata[sim].result for sim in simulations]
             for sim in simulations:
-                del self.simdata[sim]
+                if keep_network:
+                    self._teardown_devices(sim)
+                else:
+                    del self.simdata[sim]
 
         return results
 
+    def _compress_spikes(self, pc, simulations):
+        nspike = max(sim.spike_compress for sim in simulations)
+        if nspike and any(sim.cvode is not None or sim.coreneuron for sim in simulations):
+            warn("Spikes can only be compressed with fixed time steps, ignoring.")
+            nspike = 0
+        # The GIDs are compressed to 1 byte if every rank has fewer than 256 of them.
+        gids = sum(
+            len(maps["transmitters"])
+            for sim in simulations
+            for maps in self.simdata[sim].transmap.values()
+        )
+        gid_compress = pc.allreduce(gids, 2) < 256
+        # Also turns the compression of previous runs off.
+        pc.spike_compress(nspike, gid_compress)
+        if nspike:
+            report(
+                f"Compressing {nspike} spikes per exchange"
+                + (", with 1 byte GIDs" if gid_compress else ""),
+                level=3,
+            )
+
+    def rerun(self, *simulations: "Simulation", keep_network=False):
+        """
+        Run the simulations again, on the cells and connections kept by their previous
+        run. Only the devices are created again, from the current configuration.
+
+        :param keep_network: Keep the cells and connections again after this run.
+        :type keep_network: bool
+        """
+        unprepared = [sim.name for sim in simulations if sim not in self.simdata]
+        if unprepared:
+            raise AdapterError(
+                f"No network kept for simulations: {', '.join(unprepared)}"
+            )
+        for sim in simulations:
+            simdata = self.simdata[sim]
+            setup_profile = simdata.result.setup_profile
+            simdata.result = NeuronResult(sim)
+            # The network was set up once, for all of its runs.
+            simdata.result.setup_profile = setup_profile
+            self._prepare_devices(sim)
+        return self.run(*simulations, keep_network=keep_network)
+
+    def _teardown_devices(self, simulation):
+        simdata = self.simdata[simulation]
+        simdata.result.close()
+        for device in list(simdata.devices.keys()):
+            device.teardown(self, simulation, simdata)
+
+    def save_state(self, path):
+        """
+        Save the state of the network to the ``path`` directory, with a file per rank.
+        Has to be called collectively.
+        """
+        if MPI.get_rank() == 0:
+            os.makedirs(path, exist_ok=True)
+        MPI.barrier()
+        state = self.engine.SaveState()
+        state.save()
+        file = self.engine.File()
+        file.wopen(os.path.join(path, f"rank_{MPI.get_rank()}.dat"))
+        state.fwrite(file)
+        file.close()
+        MPI.barrier()
+        # The metadata is written last, to mark the checkpoint as complete.
+        if MPI.get_rank() == 0:
+            with open(os.path.join(path, "checkpoint.json"), "w") as f:
+                json.dump({"time": self.engine.t, "size": MPI.get_size()}, f)
+        report(f"Saved the state at {self.engine.t:g}ms to '{path}'", level=2)
+
+    def restore_state(self, path):
+        """
+        Restore the state of the network from the ``path`` directory. Has to be called
+        collectively, after the network was initialized.
+
+        :returns: The time at which the state was saved.
+        :rtype: float
+        """
+        self._check_checkpoint(path)
+        state = self.engine.SaveState()
+        file = self.engine.File()
+        file.ropen(os.path.join(path, f"rank_{MPI.get_rank()}.dat"))
+        state.fread(file)
+        file.close()
+        state.restore()
+        # Restart the recordings at the restored time.
+        self.engine.frecord_init()
+        report(f"Restored the state at {self.engine.t:g}ms from '{path}'", level=2)
+        return self.engine.t
+
+    def _check_checkpoint(self, path):
+        try:
+            with open(os.path.join(path, "checkpoint.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            raise SimulationError(f"No complete checkpoint found at '{path}'.") from None
+        if meta["size"] != MPI.get_size():
+            raise SimulationError(
+                f"The checkpoint at '{path}' was saved on {meta['size']} ranks, "
+                f"it can't be restored on {MPI.get_size()}."
+            )
+
+    def configure_solver(self, simulation):
+        from neuron import coreneuron
+
+        pc = self.engine.ParallelContext()
+        # Clear the partitions of previous runs before NEURON sets up the new network.
+        pc.partition()
+        cvode = self.engine.CVode()
+        if simulation.coreneuron and simulation.cvode is not None:
+            warn(
+                "CoreNEURON only supports fixed time steps, ignoring the CVode settings."
+            )
+        variable_step = simulation.cvode is not None and not simulation.coreneuron
+        cvode.active(variable_step)
+        if variable_step:
+            cvode.use_local_dt(simulation.cvode.local)
+            cvode.atol(simulation.cvode.atol)
+        # CoreNEURON needs the cache efficient memory layout.
+        cvode.cache_efficient(simulation.cache_efficient or simulation.coreneuron)
+        coreneuron.enable = simulation.coreneuron
+        coreneuron.gpu = False
+        coreneuron.file_mode = False
+        pc.nthread(simulation.threads)
+        if simulation.threads > 1 and simulation.thread_partitioning == "balanced":
+            self._partition_threads(pc, simulation.threads)
+        report(f"Simulating on {simulation.threads} thread(s)", level=3)
+
+    def _partition_threads(self, pc, threads):
+        # Each root section is a cell, assign them from most to least segments to the
+        # thread with the fewest segments.
+        roots = self.engine.SectionList()
+        roots.allroots()
+        trees = []
+        for root in roots:
+            tree = self.engine.SectionList()
+            tree.wholetree(sec=root)
+            trees.append((sum(sec.nseg for sec in tree), len(trees), root))
+        # NEURON partitions the threads by their root sections only.
+        partitions = [self.engine.SectionList() for _ in range(threads)]
+        heap = [(0, thread) for thread in range(threads)]
+        for nseg, _, root in sorted(trees, key=lambda t: (-t[0], t[1])):
+            load, thread = heapq.heappop(heap)
+            partitions[thread].append(sec=root)
+            heapq.heappush(heap, (load + nseg, thread))
+        for thread, partition in enumerate(partitions):
+            pc.partition(thread, partition)
+
+    def _initialize(self, pc, maxstep):
+        try:
+            return self._finitialize(pc, maxstep)
+        except RuntimeError as error:
+            threads = pc.nthread()
+            if threads == 1:
+                raise
+            # NEURON doesn't tell why it failed, but it refuses to initialize mechanisms
+            # that aren't thread safe outside of the first thread, so try again on 1.
+            pc.partition()
+            pc.nthread(1)
+            try:
+                maxstep = self._finitialize(pc, maxstep)
+            except RuntimeError:
+                # Not a problem with the threads.
+                raise error from None
+            warn(
+                f"NEURON couldn't initialize the network on {threads} threads (see its"
+                " error above), simulating on 1 thread."
+            )
+            return maxstep
+
+    def _finitialize(self, pc, maxstep):
+        from neuron import h
+
+        # Patch's `finitialize` resets the maximum step to 10ms, so the maximum step is
+        # set right before NEURON itself is initialized. NEURON exchanges spikes at the
+        # minimum delay of the network, capped by the maximum step.
+        self.engine._setup_transfer()
+        maxstep = pc.set_maxstep(maxstep)
+        h.finitialize(self.initial)
+        self.engine._finitialized = True
+        return maxstep
+
     def create_neurons(self, simulation):
         simdata = self.simdata[simulation]
         offset = 0
         for cell_model in sorted(simulation.cell_models.values()):
             ps = cell_model.get_placement_set()
             simdata.cid_offsets[cell_model.cell_type] = offset
-            with ps.chunk_context(simdata.chunks):
+            with ps.chunk_context(simdata.chunks), simdata.profile.phase(
+                "create_neurons", cell_model
+            ):
                 if (len(ps)) != 0:
                     self._create_population(simdata, cell_model, ps, offset)
                     offset += len(ps)
@@ -150,10 +638,13 @@ class NeuronAdapter(SimulatorAdapter):
 
     def create_connections(self, simulation):
         simdata = self.simdata[simulation]
-        self._allocate_transmitters(simulation)
+        with simdata.profile.phase("allocate_transmitters"):
+            self._allocate_transmitters(simulation)
         for conn_model in simulation.connection_models.values():
             cs = simulation.scaffold.get_connectivity_set(conn_model.name)
-            with fill_parameter_data(conn_model.parameters, []):
+            with fill_parameter_data(conn_model.parameters, []), simdata.profile.phase(
+                "create_connections", conn_model
+            ):
                 simdata.connections[conn_model] = conn_model.create_connections(
                     simulation, simdata, cs
                 )
@@ -161,81 +652,115 @@ class NeuronAdapter(SimulatorAdapter):
     def create_devices(self, simulation):
         simdata = self.simdata[simulation]
         for device_model in simulation.devices.values():
-            device_model.implement(self, simulation, simdata)
+            with simdata.profile.phase("create_devices", device_model):
+                device_model.implement(self, simulation, simdata)
+
+    def allocate_gids(self, count):
+        """
+        Reserve ``count`` GIDs for this rank. Has to be called collectively.
+
+        :returns: The reserved GIDs.
+        :rtype: range
+        """
+        counts = MPI.allgather(count)
+        first = self.next_gid + sum(counts[: MPI.get_rank()])
+        self.next_gid += sum(counts)
+        return range(first, first + count)
 
     def _allocate_transmitters(self, simulation):
         simdata = self.simdata[simulation]
+        # Only the unique transmitter locations get a GID, not every connection.
+        transmap, count = self._get_transmap(simulation, simdata)
         first = self.next_gid
-        chunk_stats = simulation.scaffold.storage.get_chunk_stats()
-        max_trans = sum(stats["connections"]["out"] for stats in chunk_stats.values())
-        report(
-            f"Allocated GIDs {first} to {first + max_trans}",
-            level=3,
-        )
-        self.next_gid += max_trans
+        self.next_gid += count
         simdata.alloc = (first, self.next_gid)
-        simdata.transmap = self._map_transceivers(simulation, simdata)
+        report(f"Allocated GIDs {first} to {self.next_gid}", level=3)
+        for maps in transmap.values():
+            for gid_map in maps.values():
+                gid_map.gids += first
+        simdata.transmap = transmap
+        # Connection models that transfer variables between cells get their own range of
+        # source variable ids, after the transmitter GIDs.
+        for conn_model, cs in simulation.get_connectivity_sets().items():
+            count = conn_model.count_source_ids(cs)
+            if count:
+                simdata.source_ids[conn_model] = range(
+                    self.next_gid, self.next_gid + count
+                )
+                self.next_gid += count
+                report(
+                    f"Allocated source variable ids {self.next_gid - count} to"
+                    f" {self.next_gid} to {conn_model.name}",
+                    level=3,
+                )
+
+    def _get_transmap(self, simulation, simdata):
+        if not simulation.transceiver_cache:
+            return self._map_transceivers(simulation, simdata)
+        path = _transmap_cache_path(simulation, simdata)
+        if path is None:
+            warn("Can't cache the transceiver map of storage without a file root.")
+            return self._map_transceivers(simulation, simdata)
+        try:
+            transmap, count = _load_transmap(path, simulation)
+        except (FileNotFoundError, KeyError):
+            transmap, count = self._map_transceivers(simulation, simdata)
+            _save_transmap(path, transmap, count)
+            report(f"Cached transceiver map at '{path}'", level=3)
+        else:
+            report(f"Loaded cached transceiver map from '{path}'", level=3)
+        return transmap, count
 
     def _map_transceivers(self, simulation, simdata):
         offset = 0
         transmap = {}
+        our_chunks = set(simdata.chunks)
 
-        pre_types = set(cs.pre_type for cs in simulation.get_connectivity_sets().values())
+        connectivity_sets = _spiking_connectivity_sets(simulation)
+        pre_types = set(cs.pre_type for cs in connectivity_sets.values())
         for pre_type in sorted(pre_types, key=lambda pre_type: pre_type.name):
+            shift = _scoping_shift(pre_type, simdata.chunks)
             data = []
-            for cm, cs in simulation.get_connectivity_sets().items():
-                if cs.pre_type != pre_type:
-                    continue
-                pre, _ = cs.load_connections().as_globals().all()
-                data.append(pre[:, :2])
-
-            data = self.better_concat(data)
-            # Save all transmitters of the same pre_type across connectivity sets
-            all_cm_transmitters = np.unique(data, axis=0)
-            for cm, cs in simulation.get_connectivity_sets().items():
+            local_data = {}
+            for cm, cs in connectivity_sets.items():
                 if cs.pre_type != pre_type:
                     continue
-
-                # Now look up which transmitters are on our chunks
-                pre_t, _ = cs.load_connections().from_(simdata.chunks).as_globals().all()
-                our_cm_transmitters = np.unique(pre_t[:, :2], axis=0)
-                # Look up the local ids of those transmitters
-                pre_lc, _ = cs.load_connections().from_(simdata.chunks).all()
-                local_cm_transmitters = np.unique(pre_lc[:, :2], axis=0)
-
-                # Find the common indexes between all the transmitters, and the
-                # transmitters on our chunk.
-                dtype = ", ".join([str(all_cm_transmitters.dtype)] * 2)
-                _, _, idx_tm = np.intersect1d(
-                    our_cm_transmitters.view(dtype),
-                    all_cm_transmitters.view(dtype),
-                    assume_unique=True,
-                    return_indices=True,
+                # Stream through the entire connectivity set once, and sort out which
+                # blocks contain our transmitters, and which blocks contain our
+                # receivers. Only the unique keys are kept.
+                all_keys, our_keys, rcv_keys = (
+                    _UniqueKeys(simulation.connection_block_size) for _ in range(3)
                 )
+                itr = cs.load_connections().as_globals()
+                for pre_chunk, pre_locs, post_chunk, _ in itr.chunk_iter():
+                    keys = pack_locations(pre_locs)
+                    all_keys.add(keys)
+                    if pre_chunk in our_chunks:
+                        our_keys.add(keys)
+                    if post_chunk in our_chunks:
+                        rcv_keys.add(keys)
+                data.append(all_keys.get())
+                local_data[cm] = (our_keys.get(), rcv_keys.get())
 
-                # Look up which transmitters have receivers on our chunks
-                pre_gc, _ = cs.load_connections().incoming().to(simdata.chunks).all()
-                local_cm_receivers = np.unique(pre_gc[:, :2], axis=0)
-                _, _, idx_rcv = np.intersect1d(
-                    local_cm_receivers.view(dtype),
-                    all_cm_transmitters.view(dtype),
-                    assume_unique=True,
-                    return_indices=True,
-                )
-
-                # Store a map of the local chunk transmitters to their GIDs
+            # Save all transmitters of the same pre_type across connectivity sets
+            all_cm_transmitters = _unique_keys(data)
+            for cm, (our_keys, rcv_keys) in local_data.items():
+                # Store a map of the local chunk transmitters to their GIDs. The
+                # transmitters are keyed by the population index of their cell, and the
+                # receivers by the global id of the presynaptic cell.
                 transmap[cm] = {
-                    "transmitters": dict(
-                        zip(map(tuple, local_cm_transmitters), map(int, idx_tm + offset))
+                    "transmitters": GIDMap(
+                        shift.to_scoped(our_keys),
+                        np.searchsorted(all_cm_transmitters, our_keys) + offset,
                     ),
-                    "receivers": dict(
-                        zip(map(tuple, local_cm_receivers), map(int, idx_rcv + offset))
+                    "receivers": GIDMap(
+                        rcv_keys, np.searchsorted(all_cm_transmitters, rcv_keys) + offset
                     ),
                 }
 
             # Offset by the total amount of transmitter GIDs used by this ConnSet.
             offset += len(all_cm_transmitters)
-        return transmap
+        return transmap, offset
 
     def better_concat(self, items):
         if not items:
@@ -264,42 +789,329 @@ class NeuronAdapter(SimulatorAdapter):
 
         with fill_parameter_data(cell_model.parameters, data):
             instances = cell_model.create_instances(len(ps), *data)
-            simdata.populations[cell_model] = NeuronPopulation(cell_model, instances)
+            simdata.populations[cell_model] = NeuronPopulation(
+                cell_model,
+                instances,
+                ids=data[0] if isinstance(data[0], np.ndarray) else None,
+            )
+
+
+class GIDMap:
+    """
+    Array-backed map of cell locations to GIDs. The ``(cell_id, branch)`` locations are
+    packed into sorted ``int64`` keys, and looked up with a binary search.
+    """
+
+    def __init__(self, keys, gids):
+        order = np.argsort(keys, kind="stable")
+        self.keys = np.asarray(keys, dtype=np.int64)[order]
+        self.gids = np.asarray(gids, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def locations(self):
+        """
+        The ``(cell_id, branch)`` locations in the map, in ascending order.
+        """
+        return unpack_locations(self.keys)
+
+    def lookup(self, locs):
+        """
+        Look up the GIDs of an ``(N, 2+)`` array of cell locations.
+
+        :raises KeyError: When any of the locations is not in the map.
+        """
+        keys = pack_locations(locs)
+        idx = np.searchsorted(self.keys, keys)
+        idx[idx == len(self.keys)] = 0
+        missing = (self.keys[idx] != keys) if len(self.keys) else np.ones_like(keys, bool)
+        if np.any(missing):
+            raise KeyError(
+                f"No GID for location {tuple(unpack_locations(keys[missing][:1])[0])}"
+            )
+        return self.gids[idx]
+
+
+def pack_locations(locs):
+    """
+    Pack the cell id and branch columns of a location array into sortable int64 keys.
+    """
+    locs = np.asarray(locs, dtype=np.int64)
+    return (locs[:, 0] << 32) + (locs[:, 1] + _BRANCH_BIAS)
+
+
+def unpack_locations(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    return np.column_stack((keys >> 32, (keys & 0xFFFFFFFF) - _BRANCH_BIAS))
+
+
+_BRANCH_BIAS = 2**31
+
+
+def _unique_keys(blocks):
+    if not blocks:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(blocks))
+
+
+class _UniqueKeys:
+    """
+    Unique keys of a stream of blocks. The blocks are deduplicated every ``block_size``
+    keys, so that only the unique keys and the blocks since are kept in memory.
+    """
+
+    def __init__(self, block_size=None):
+        self._block_size = block_size
+        self._unique = np.empty(0, dtype=np.int64)
+        self._blocks = []
+        self._pending = 0
+
+    def add(self, keys):
+        self._blocks.append(keys)
+        self._pending += len(keys)
+        if self._block_size is not None and self._pending >= self._block_size:
+            self._reduce()
+
+    def get(self):
+        self._reduce()
+        return self._unique
+
+    def _reduce(self):
+        if self._blocks:
+            self._unique = _unique_keys([self._unique, *self._blocks])
+            self._blocks = []
+            self._pending = 0
+
+
+class _ScopingShift:
+    """
+    Converts global cell ids into the population indices of the chunks of this rank.
+    """
+
+    def __init__(self, starts, shifts):
+        self._starts = starts
+        self._shifts = shifts
+
+    def to_scoped(self, keys):
+        if not len(keys) or not len(self._starts):
+            return keys
+        return keys - (self._shifts_of(keys >> 32) << 32)
+
+    def to_scoped_ids(self, ids):
+        if not len(ids) or not len(self._starts):
+            return ids
+        return ids - self._shifts_of(ids)
 
+    def _shifts_of(self, ids):
+        idx = np.searchsorted(self._starts, ids, side="right") - 1
+        return self._shifts[idx]
 
-class NeuronPopulation(list):
-    def __init__(self, model: "NeuronCell", instances: list):
+
+def _scoping_shift(cell_type, chunks):
+    stats = cell_type.get_placement_set().get_chunk_stats()
+    our_chunks = set(chunks)
+    starts, shifts = [], []
+    global_ctr = scoped_ctr = 0
+    for chunk, len_ in sorted(
+        ((Chunk.from_id(int(k), None), v) for k, v in stats.items()),
+        key=lambda k: k[0].id,
+    ):
+        if chunk in our_chunks:
+            starts.append(global_ctr)
+            shifts.append(global_ctr - scoped_ctr)
+            scoped_ctr += len_
+        global_ctr += len_
+    return _ScopingShift(
+        np.array(starts, dtype=np.int64), np.array(shifts, dtype=np.int64)
+    )
+
+
+def _transmap_cache_path(simulation, simdata):
+    root = simulation.scaffold.storage.root
+    if not isinstance(root, (str, os.PathLike)) or not os.path.exists(root):
+        return None
+    root = os.path.abspath(root)
+    connectivity_sets = simulation.get_connectivity_sets()
+    # Any change to the storage, the connectivity, the connection models that spike or
+    # the chunks of this rank invalidates the cache.
+    key = {
+        "version": 4,
+        "root": root,
+        "mtime": os.path.getmtime(root),
+        "size": os.path.getsize(root),
+        "connectivity": [
+            [
+                cm.name,
+                cm.spiking,
+                cs.tag,
+                cs.pre_type.name,
+                cs.post_type.name,
+                _connectivity_stats(cs),
+            ]
+            for cm, cs in connectivity_sets.items()
+        ],
+        "placement": {
+            cs.pre_type.name: cs.pre_type.get_placement_set().get_chunk_stats()
+            for cs in connectivity_sets.values()
+        },
+        "chunks": sorted(int(chunk.id) for chunk in simdata.chunks),
+    }
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return os.path.join(f"{root}.neuron-cache", f"transmap_{digest}.npz")
+
+
+def _connectivity_stats(cs):
+    # Use the connection counts per chunk that the engine stores, counting the
+    # connections themselves would load all of them.
+    try:
+        return cs.get_chunk_stats()
+    except AttributeError:
+        return sorted(int(chunk.id) for chunk in cs.get_local_chunks("out"))
+
+
+def _save_transmap(path, transmap, count):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {"count": np.array(count)}
+    for cm, maps in transmap.items():
+        for kind, gid_map in maps.items():
+            arrays[f"{cm.name}/{kind}/keys"] = gid_map.keys
+            arrays[f"{cm.name}/{kind}/gids"] = gid_map.gids
+    # Write to a temporary file first, so that concurrent jobs never read partial files.
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def _load_transmap(path, simulation):
+    with np.load(path) as arrays:
+        transmap = {
+            cm: {
+                kind: GIDMap(
+                    arrays[f"{cm.name}/{kind}/keys"], arrays[f"{cm.name}/{kind}/gids"]
+                )
+                for kind in ("transmitters", "receivers")
+            }
+            for cm in _spiking_connectivity_sets(simulation).keys()
+        }
+        return transmap, int(arrays["count"])
+
+
+def _spiking_connectivity_sets(simulation):
+    return {cm: cs for cm, cs in simulation.get_connectivity_sets().items() if cm.spiking}
+
+
+class _CellLookup:
+    def by_id(self, ids):
+        """
+        Get the instance with the given cell id, or a view of the instances with the given
+        cell ids.
+
+        :raises KeyError: If any of the cell ids is not in the population.
+        """
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind="stable")
+        sorted_ids = self.ids[self._id_order]
+        query = np.asarray(ids, dtype=int)
+        flat = query.ravel()
+        pos = np.searchsorted(sorted_ids, flat)
+        missing = pos >= len(sorted_ids)
+        missing[~missing] = sorted_ids[pos[~missing]] != flat[~missing]
+        if missing.any():
+            raise KeyError(f"Cell ids not in the population: {flat[missing].tolist()}")
+        indices = self._id_order[pos]
+        return self[indices[0]] if query.ndim == 0 else self[indices]
+
+
+class NeuronPopulation(_CellLookup, list):
+    """
+    The instances of a cell model on this rank. Indexing with a slice, boolean mask or
+    array of indices returns a :class:`NeuronPopulationView` of the selected instances.
+    """
+
+    def __init__(self, model: "NeuronCell", instances: list, ids=None):
         self._model = model
         super().__init__(instances)
         for instance in instances:
             instance.cell_model = model
+        if ids is None:
+            ids = [instance.id for instance in instances]
+        self._ids = np.array(ids, dtype=int)
+        self._id_order = None
+
+    @property
+    def ids(self):
+        """
+        Cell ids of the instances.
+        """
+        return self._ids
 
     def __getitem__(self, item):
-        # Boolean masking, kind of
-        if getattr(item, "dtype", None) == bool or _all_bools(item):
-            if len(self) == len(item):
-                return NeuronPopulation(self._model, [p for p, b in zip(self, item) if b])
-            else:
-                raise SimulationError
-        elif getattr(item, "dtype", None) == int or _all_ints(item):
-            if getattr(item, "ndim", None) == 0:
-                return super().__getitem__(item)
-            return NeuronPopulation(self._model, [self[i] for i in item])
-        else:
+        if _is_scalar(item):
             return super().__getitem__(item)
+        indices = _to_indices(item, len(self))
+        if indices is None:
+            return super().__getitem__(item)
+        return NeuronPopulationView(self, indices)
 
 
-def _all_bools(arr):
-    try:
-        return all(isinstance(b, bool) for b in arr)
-    except TypeError:
-        # Not iterable
-        return False
+class NeuronPopulationView(_CellLookup, Sequence):
+    """
+    Selection of the instances of a :class:`NeuronPopulation`, without copying them.
+    """
 
+    def __init__(self, population: NeuronPopulation, indices: np.ndarray):
+        self._population = population
+        self._model = population._model
+        self._indices = indices
+        self._id_order = None
 
-def _all_ints(arr):
-    try:
-        return all(isinstance(b, int) for b in arr)
-    except TypeError:
-        # Not iterable
-        return False
+    @property
+    def ids(self):
+        """
+        Cell ids of the instances.
+        """
+        return self._population.ids[self._indices]
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __iter__(self):
+        return map(
+            list.__getitem__, itertools.repeat(self._population), self._indices.tolist()
+        )
+
+    def __getitem__(self, item):
+        if _is_scalar(item):
+            return list.__getitem__(self._population, self._indices[item])
+        indices = _to_indices(item, len(self))
+        if indices is None:
+            raise TypeError(f"Populations can't be indexed with {type(item).__name__}.")
+        return NeuronPopulationView(self._population, self._indices[indices])
+
+
+def _is_scalar(item):
+    return isinstance(item, (int, np.integer)) or getattr(item, "ndim", None) == 0
+
+
+def _to_indices(item, size):
+    # Positions selected by a slice, boolean mask or array of indices, or None for other
+    # kinds of indices.
+    if isinstance(item, slice):
+        return np.arange(*item.indices(size))
+    item = np.asarray(item)
+    if item.dtype == bool:
+        if item.shape != (size,):
+            raise SimulationError(
+                f"Can't mask a population of {size} cells with a mask of {len(item)}."
+            )
+        return np.flatnonzero(item)
+    elif not item.size:
+        return np.empty(0, dtype=int)
+    elif np.issubdtype(item.dtype, np.integer):
+        if item.max() >= size or item.min() < -size:
+            raise IndexError(f"Population index out of range for {size} cells.")
+        return np.where(item < 0, item + size, item)
+    return None
@@ -0,0 +1,142 @@
+import heapq
+import typing
+
+import numpy as np
+from bsb import Chunk, DatasetNotFoundError, config, report, types
+
+if typing.TYPE_CHECKING:
+    from .simulation import NeuronSimulation
+
+
+@config.dynamic(
+    attr_name="strategy", required=False, default="round_robin", auto_classmap=True
+)
+class LoadBalancing:
+    """
+    Strategy that distributes the chunks of the network over the MPI ranks.
+    """
+
+    def allocate(self, simulation: "NeuronSimulation", size: int):
+        """
+        Divide the chunks over ``size`` ranks.
+
+        :returns: A list with the chunks, and a list with the predicted load of each
+          rank.
+        :rtype: tuple[list[list[bsb.Chunk]], list[float]]
+        """
+        raise NotImplementedError(
+            "Load balancing strategies should implement the `allocate` method."
+        )
+
+    def get_chunks(self, simulation: "NeuronSimulation"):
+        chunk_stats = simulation.scaffold.storage.get_chunk_stats()
+        return [Chunk.from_id(int(chunk), None) for chunk in chunk_stats.keys()]
+
+
+@config.node
+class RoundRobinBalancing(LoadBalancing, classmap_entry="round_robin"):
+    """
+    Deal the chunks out to the ranks like a deck of cards, regardless of their content.
+    """
+
+    def allocate(self, simulation, size):
+        all_chunks = self.get_chunks(simulation)
+        alloc = [all_chunks[rank::size] for rank in range(0, size)]
+        return alloc, [float(len(chunks)) for chunks in alloc]
+
+
+@config.node
+class GreedyBalancing(LoadBalancing, classmap_entry="greedy"):
+    """
+    Estimate the cost of each chunk from the chunk statistics and assign the chunks, from
+    most to least expensive, to the least loaded rank (LPT scheduling).
+    """
+
+    cell_cost = config.attr(type=types.float(min=0.0), default=1.0)
+    """Cost of each simulated cell in a chunk."""
+    receiver_cost = config.attr(type=types.float(min=0.0), default=0.1)
+    """Cost of each incoming connection in a chunk."""
+    transmitter_cost = config.attr(type=types.float(min=0.0), default=0.01)
+    """Cost of each outgoing connection in a chunk."""
+    compartment_cost = config.attr(type=types.float(min=0.0), default=0.0)
+    """Cost of each branch of the morphologies in a chunk. Loads all morphologies."""
+    model_costs = config.dict(type=types.float(min=0.0))
+    """Multiplier of the cell and compartment costs per cell model."""
+
+    def allocate(self, simulation, size):
+        all_chunks = self.get_chunks(simulation)
+        costs = self.estimate_costs(simulation, all_chunks)
+        # Sort by descending cost, ties broken by chunk id, so that every rank arrives at
+        # the same allocation independently.
+        order = sorted(
+            range(len(all_chunks)), key=lambda i: (-costs[i], int(all_chunks[i].id))
+        )
+        heap = [(0.0, rank) for rank in range(size)]
+        alloc = [[] for _ in range(size)]
+        loads = [0.0] * size
+        for i in order:
+            load, rank = heapq.heappop(heap)
+            alloc[rank].append(all_chunks[i])
+            loads[rank] = load + costs[i]
+            heapq.heappush(heap, (loads[rank], rank))
+        return alloc, loads
+
+    def estimate_costs(self, simulation, chunks):
+        """
+        Estimate the cost of simulating each of the given chunks.
+        """
+        chunk_stats = simulation.scaffold.storage.get_chunk_stats()
+        keys = [str(int(chunk.id)) for chunk in chunks]
+        costs = np.zeros(len(chunks))
+        for i, key in enumerate(keys):
+            stats = chunk_stats.get(key, {})
+            conns = stats.get("connections", {})
+            costs[i] += self.receiver_cost * conns.get("inc", 0)
+            costs[i] += self.transmitter_cost * conns.get("out", 0)
+        for cell_model in simulation.cell_models.values():
+            multiplier = self.model_costs.get(cell_model.name, 1.0)
+            ps = cell_model.get_placement_set()
+            ps_stats = ps.get_chunk_stats()
+            counts = np.array([ps_stats.get(key, 0) for key in keys], dtype=float)
+            costs += multiplier * self.cell_cost * counts
+            if self.compartment_cost:
+                costs += (
+                    multiplier
+                    * self.compartment_cost
+                    * self._count_branches(ps, chunks, counts)
+                )
+        return costs
+
+    def _count_branches(self, ps, chunks, counts):
+        branches = np.zeros(len(chunks))
+        # Each unique morphology is loaded only once, no matter how many chunks use it.
+        sizes = {}
+        for i, chunk in enumerate(chunks):
+            if not counts[i]:
+                continue
+            try:
+                with ps.chunk_context([chunk]):
+                    morphologies = ps.load_morphologies()
+            except DatasetNotFoundError:
+                continue
+            for name, loader in zip(morphologies.names, morphologies._loaders):
+                if name not in sizes:
+                    sizes[name] = len(loader.load().branches)
+            loader_sizes = np.array([sizes[name] for name in morphologies.names])
+            branches[i] = loader_sizes[morphologies.get_indices(copy=False)].sum()
+        return branches
+
+
+def report_allocation(alloc, loads):
+    total = sum(loads)
+    for rank, (chunks, load) in enumerate(zip(alloc, loads)):
+        report(
+            f"Rank {rank}: {len(chunks)} chunks, predicted load {load:.1f}",
+            level=3,
+        )
+    if total and loads:
+        mean = total / len(loads)
+        report(f"Load imbalance (max/mean): {max(loads) / mean:.2f}", level=2)
+
+
+__all__ = ["GreedyBalancing", "LoadBalancing", "RoundRobinBalancing"]
@@ -1,87 +1,242 @@
-import itertools
-from typing import TYPE_CHECKING
-
-from arborize import ModelDefinition, define_model
-from bsb import CellModel, config, types
-
-if TYPE_CHECKING:
-    from bsb.morphologies import MorphologySet
-
-
-@config.dynamic(
-    attr_name="model_strategy", required=False, default="arborize", auto_classmap=True
-)
-class NeuronCell(CellModel):
-    def create_instances(self, count, ids, pos, morpho: "MorphologySet", rot, additional):
-        def dictzip():
-            yield from (
-                dict(zip(additional.keys(), values[:-1]))
-                for values in itertools.zip_longest(
-                    *additional.values(), itertools.repeat(count)
-                )
-            )
-
-        ids, pos, morpho, rot = (
-            iter(ids),
-            iter(pos),
-            iter(morpho),
-            iter(rot),
-        )
-        additer = dictzip()
-        return [
-            self._create(next(ids), next(pos), next(morpho), next(rot), next(additer))
-            for i in range(count)
-        ]
-
-    def _create(self, id, pos, morpho, rot, additional):
-        if morpho is None:
-            raise RuntimeError(
-                f"Cell {id} of {self.name} has no morphology, can't use {self.__class__.__name__} to construct it."
-            )
-        instance = self.create(id, pos, morpho, rot, additional)
-        instance.id = id
-        return instance
-
-
-class ArborizeModelTypeHandler(types.object_):
-    @property
-    def __name__(self):
-        return "arborized model definition"
-
-    def __call__(self, value):
-        if isinstance(value, dict):
-            model = define_model(value)
-            model._cfg_inv = value
-            return model
-        else:
-            return super().__call__(value)
-
-    def __inv__(self, value):
-        inv_value = super().__inv__(value)
-
-        if isinstance(inv_value, ModelDefinition):
-            inv_value = inv_value.to_dict()
-        return inv_value
-
-
-@config.node
-class ArborizedModel(NeuronCell, classmap_entry="arborize"):
-    model = config.attr(type=ArborizeModelTypeHandler(), required=True)
-    _schematics = {}
-
-    def create(self, id, pos, morpho, rot, additional):
-        from arborize import bsb_schematic, neuron_build
-
-        self.model.use_defaults = True
-        schematic = bsb_schematic(morpho, self.model)
-        return neuron_build(schematic)
-
-
-class Shim:
-    pass
-
-
-@config.node
-class ShimModel(NeuronCell, classmap_entry="shim"):
-    def create(self, id, pos, morpho, rot, additional):
-        return Shim()
+import contextlib
+import itertools
+import multiprocessing
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from arborize import ModelDefinition, define_model
+from bsb import Branch, CellModel, Morphology, MorphologySet, config, types
+from bsb._encoding import EncodedLabels
+
+
+@config.dynamic(
+    attr_name="model_strategy", required=False, default="arborize", auto_classmap=True
+)
+class NeuronCell(CellModel):
+    share_morphologies = False
+    """
+    Whether cells with the same morphology may receive the same, read-only, morphology
+    object in :meth:`create`, instead of their own copy.
+    """
+
+    def create_instances(self, count, ids, pos, morpho: "MorphologySet", rot, additional):
+        def dictzip():
+            yield from (
+                dict(zip(additional.keys(), values[:-1]))
+                for values in itertools.zip_longest(
+                    *additional.values(), itertools.repeat(count)
+                )
+            )
+
+        ids, pos, morpho, rot = (
+            iter(ids),
+            iter(pos),
+            self._iter_morphologies(morpho),
+            iter(rot),
+        )
+        additer = dictzip()
+        return [
+            self._create(next(ids), next(pos), next(morpho), next(rot), next(additer))
+            for i in range(count)
+        ]
+
+    def _iter_morphologies(self, morpho):
+        if not self.share_morphologies or not isinstance(morpho, MorphologySet):
+            return iter(morpho)
+        # Load each unique morphology once, and hand out the same object to all of its
+        # cells.
+        indices = morpho.get_indices(copy=False)
+        # `get` takes the position of a cell, so each morphology is loaded through the
+        # first cell that has it.
+        unique, first = np.unique(indices, return_index=True)
+        loaded = {idx: morpho.get(pos) for idx, pos in zip(unique, first)}
+        self.prepare_morphologies(list(loaded.values()))
+        return (loaded[idx] for idx in indices)
+
+    def prepare_morphologies(self, morphologies):
+        """
+        Called with the unique morphologies of a population before its cells are created,
+        when the model shares its morphologies.
+        """
+        pass
+
+    def _create(self, id, pos, morpho, rot, additional):
+        if morpho is None:
+            raise RuntimeError(
+                f"Cell {id} of {self.name} has no morphology, can't use {self.__class__.__name__} to construct it."
+            )
+        instance = self.create(id, pos, morpho, rot, additional)
+        instance.id = id
+        if self.share_morphologies:
+            # Lets devices resolve their locations once per morphology.
+            instance.morphology = morpho
+        return instance
+
+
+class ArborizeModelTypeHandler(types.object_):
+    @property
+    def __name__(self):
+        return "arborized model definition"
+
+    def __call__(self, value):
+        if isinstance(value, dict):
+            model = define_model(value)
+            model._cfg_inv = value
+            return model
+        else:
+            return super().__call__(value)
+
+    def __inv__(self, value):
+        inv_value = super().__inv__(value)
+
+        if isinstance(inv_value, ModelDefinition):
+            inv_value = inv_value.to_dict()
+        return inv_value
+
+
+SchematicCacheInfo = namedtuple("SchematicCacheInfo", ["hits", "misses", "currsize"])
+
+
+@config.node
+class ArborizedModel(NeuronCell, classmap_entry="arborize"):
+    model = config.attr(type=ArborizeModelTypeHandler(), required=True)
+    share_morphologies = True
+    _schematics = None
+    _schematic_hits = 0
+    _schematic_misses = 0
+
+    def create_instances(self, *args, **kwargs):
+        # Cells that share a morphology object are built from the same schematic. The
+        # cache is keyed by object identity, so it is only valid during this call.
+        self._schematics = {}
+        try:
+            return super().create_instances(*args, **kwargs)
+        finally:
+            self._schematics = None
+
+    def prepare_morphologies(self, morphologies):
+        workers = self.simulation.schematic_workers
+        if self._schematics is None:
+            self._schematics = {}
+        missing = [m for m in morphologies if id(m) not in self._schematics]
+        if workers < 2 or len(missing) < 2:
+            # Not worth a pool, the schematics are built on demand in `create`.
+            return
+        self.model.use_defaults = True
+        # Forked workers would inherit the MPI and NEURON state of this process, so they
+        # are started as fresh interpreters instead.
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(missing)),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as pool:
+            with _without_mpi_launcher():
+                schematics = pool.map(
+                    _build_schematic,
+                    (_pack_morphology(m) for m in missing),
+                    itertools.repeat(self.model),
+                )
+            for morpho, schematic in zip(missing, schematics):
+                self._schematic_misses += 1
+                self._schematics[id(morpho)] = (morpho, schematic)
+
+    def create(self, id, pos, morpho, rot, additional):
+        from arborize import neuron_build
+
+        return neuron_build(self.get_schematic(morpho))
+
+    def get_schematic(self, morpho):
+        """
+        Get the schematic of the model for the given morphology, reusing the schematic of
+        an earlier cell with the same morphology object.
+        """
+        from arborize import bsb_schematic
+
+        if self._schematics is None:
+            self._schematics = {}
+        try:
+            schematic = self._schematics[id(morpho)][1]
+        except KeyError:
+            self._schematic_misses += 1
+            self.model.use_defaults = True
+            schematic = bsb_schematic(morpho, self.model)
+            # Keep a reference to the morphology, so that its id can't be reused.
+            self._schematics[id(morpho)] = (morpho, schematic)
+        else:
+            self._schematic_hits += 1
+        return schematic
+
+    def schematic_cache_info(self):
+        """
+        Report the schematic cache statistics of all the cells created by this model.
+        """
+        return SchematicCacheInfo(
+            self._schematic_hits, self._schematic_misses, len(self._schematics or ())
+        )
+
+
+def _pack_morphology(morpho):
+    # Morphologies can't be pickled, so we send their branches as plain arrays.
+    branches = morpho.branches
+    index = {id(branch): i for i, branch in enumerate(branches)}
+    return dict(morpho.meta), [
+        (
+            branch.points,
+            branch.radii,
+            np.asarray(branch.labels),
+            {k: set(v) for k, v in branch.labels.labels.items()},
+            index.get(id(branch.parent), -1),
+        )
+        for branch in branches
+    ]
+
+
+def _unpack_morphology(data):
+    meta, packed = data
+    branches = []
+    roots = []
+    for points, radii, codes, labelsets, parent in packed:
+        labels = EncodedLabels(codes.shape, dtype=codes.dtype, labels=labelsets)
+        labels[:] = codes
+        branch = Branch(points, radii, labels=labels)
+        if parent == -1:
+            roots.append(branch)
+        else:
+            branches[parent].attach_child(branch)
+        branches.append(branch)
+    return Morphology(roots, meta=meta)
+
+
+_MPI_LAUNCHER_PREFIXES = ("OMPI_", "PMIX_", "PMI_", "HYDI_", "HYDRA_")
+
+
+@contextlib.contextmanager
+def _without_mpi_launcher():
+    # Processes started with the environment of the MPI launcher would try to join its
+    # job when they import MPI, so they are started without it.
+    hidden = {
+        key: os.environ.pop(key)
+        for key in list(os.environ)
+        if key.startswith(_MPI_LAUNCHER_PREFIXES)
+    }
+    try:
+        yield
+    finally:
+        os.environ.update(hidden)
+
+
+def _build_schematic(data, model):
+    from arborize import bsb_schematic
+
+    return bsb_schematic(_unpack_morphology(data), model)
+
+
+class Shim:
+    pass
+
+
+@config.node
+class ShimModel(NeuronCell, classmap_entry="shim"):
+    def create(self, id, pos, morpho, rot, additional):
+        return Shim()
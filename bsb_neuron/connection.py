@@ -1,7 +1,18 @@
+import functools
 import typing
 
 import numpy as np
-from bsb import AdapterError, ConnectionModel, Parameter, config, types
+from bsb import (
+    MPI,
+    AdapterError,
+    ConnectionModel,
+    Distribution,
+    Parameter,
+    config,
+    types,
+)
+
+from .adapter import _scoping_shift
 
 if typing.TYPE_CHECKING:
     from bsb import ConnectivitySet
@@ -17,17 +28,186 @@ if typing.TYPE_CHECKING:
     auto_classmap=True,
 )
 class NeuronConnection(ConnectionModel):
+    spiking = True
+    """
+    Whether the model connects the cells through the spikes of transmitters, that get a
+    GID.
+    """
+
     def create_connections(self, simulation, simdata, connections):
         raise NotImplementedError(
             "Cell models should implement the `create_connections` method."
         )
 
+    def count_source_ids(self, cs: "ConnectivitySet"):
+        """
+        Number of source variable ids the model needs to transfer variables between the
+        cells of the connectivity set. They are allocated in ``simdata.source_ids``.
+        """
+        return 0
+
+
+@config.dynamic(attr_name="type", required=False, default="constant", auto_classmap=True)
+class ConnectionValue:
+    """
+    Value of a property of the synapses, resolved for all the connections at once.
+    """
+
+    def resolve(self, connections: "ConnectionData"):
+        """
+        :returns: The value of each of the connections.
+        :rtype: numpy.ndarray
+        """
+        raise NotImplementedError(
+            "Connection values should implement the `resolve` method."
+        )
+
+
+@config.node
+class ConstantValue(ConnectionValue, classmap_entry="constant"):
+    value = config.attr(type=float, required=types.shortform())
+
+    def __init__(self, constant=None, /, **kwargs):
+        if constant is not None:
+            self.value = constant
+
+    def resolve(self, connections):
+        return np.full(len(connections), self.value)
+
+
+@config.node
+class DistanceValue(ConnectionValue, classmap_entry="distance"):
+    """
+    Value that changes linearly with the distance between the pre- and postsynaptic
+    cell, such as a delay of ``intercept + distance / velocity``.
+    """
+
+    intercept = config.attr(type=float, default=0.0)
+    """Value at a distance of 0."""
+    slope = config.attr(type=float, default=0.0)
+    """Change of the value per µm."""
+
+    def resolve(self, connections):
+        return self.intercept + self.slope * connections.distance
+
+
+@config.node
+class DistributionValue(ConnectionValue, classmap_entry="distribution"):
+    """
+    Value drawn from a distribution for each connection. With the random streams of the
+    simulation, the value of a connection only depends on the seed and the connection.
+    """
+
+    distribution = config.attr(type=Distribution, required=True)
+
+    def resolve(self, connections):
+        if connections.streams is None or not hasattr(self.distribution, "ppf"):
+            return np.asarray(self.distribution.draw(len(connections)), dtype=float)
+        return np.asarray(self.distribution.ppf(connections.uniform(self)), dtype=float)
+
+
+@config.node
+class ExpressionValue(ConnectionValue, classmap_entry="expression"):
+    """
+    Value calculated by a numpy expression, of the ``distance``, ``pre_position`` and
+    ``post_position`` arrays of the connections, and ``np``.
+    """
+
+    expression = config.attr(type=str, required=True)
+
+    def resolve(self, connections):
+        code = compile(self.expression, "<expression>", "eval")
+        # Only the connection data used by the expression is loaded.
+        names = {
+            name: getattr(connections, name)
+            for name in code.co_names
+            if name in ConnectionData.variables
+        }
+        values = eval(code, {"np": np}, names)
+        return np.broadcast_to(np.asarray(values, dtype=float), (len(connections),))
+
+
+class ConnectionData:
+    """
+    Data of connections, loaded when a connection value needs it. Positions are those
+    of the cells, not of the synapses.
+
+    :param post_chunks: Chunks that the postsynaptic cell ids are local to. By default
+      the ids are global.
+    :param streams: Random streams of the simulation.
+    :type streams: ~bsb_neuron.seeding.RandomStreams
+    :param placement: Placement data of the cells, shared by the blocks of connections
+      of a connectivity set, so that it is loaded once.
+    :type placement: dict
+    """
+
+    variables = ("distance", "pre_position", "post_position")
+
+    def __init__(
+        self,
+        cs: "ConnectivitySet",
+        pre,
+        post,
+        post_chunks=None,
+        streams=None,
+        placement=None,
+    ):
+        self._cs = cs
+        self._post_chunks = post_chunks
+        self._placement = placement if placement is not None else {}
+        self.pre = pre
+        self.post = post
+        self.streams = streams
+
+    def __len__(self):
+        return len(self.pre)
+
+    def _load(self, side, data):
+        try:
+            return self._placement[side, data]
+        except KeyError:
+            if side == "pre":
+                ps = self._cs.pre_type.get_placement_set()
+            else:
+                ps = self._cs.post_type.get_placement_set(chunks=self._post_chunks)
+            values = self._placement[side, data] = getattr(ps, f"load_{data}")()
+            return values
+
+    @functools.cached_property
+    def pre_position(self):
+        return self._load("pre", "positions")[self.pre[:, 0]]
+
+    @functools.cached_property
+    def post_position(self):
+        return self._load("post", "positions")[self.post[:, 0]]
+
+    @functools.cached_property
+    def distance(self):
+        return np.linalg.norm(self.post_position - self.pre_position, axis=1)
+
+    @functools.cached_property
+    def post_ids(self):
+        """Global ids of the postsynaptic cells."""
+        if self._post_chunks is None:
+            return self.post[:, 0]
+        return self._load("post", "ids")[self.post[:, 0]]
+
+    def uniform(self, node):
+        """
+        Uniform random value in [0, 1) of each connection, from the stream of ``node``.
+        """
+        return self.streams.uniform(
+            node, np.column_stack((self.pre, self.post_ids, self.post[:, 1:]))
+        )
+
 
 @config.node
 class SynapseSpec:
     synapse = config.attr(type=str, required=types.shortform())
-    weight = config.attr(type=float, default=0.004)
-    delay = config.attr(type=float, default=0.0)
+    weight = config.attr(type=ConnectionValue, default=0.004)
+    delay = config.attr(type=ConnectionValue, default=0.0)
+    attributes = config.dict(type=ConnectionValue)
+    """Parameters of the synapse, set for each connection."""
     parameters = config.list(type=Parameter)
 
     def __init__(self, synapse_name=None, /, **kwargs):
@@ -59,16 +239,13 @@ class TransceiverModel(NeuronConnection, classmap_entry="transceiver"):
                 break
         else:
             raise AdapterError(f"No pop found for {cs.pre_type.name}")
-        pre, _ = cs.load_connections().from_(simdata.chunks).all()
         transmitters = simdata.transmap[self]["transmitters"]
-        locs = np.unique(pre[:, :2], axis=0)
-        for loc in locs:
-            gid = transmitters[tuple(loc)]
-            cell = pop[loc[0]]
+        for (cell_id, branch), gid in zip(transmitters.locations, transmitters.gids):
+            cell = pop[cell_id]
             # NEURON only allows 1 spike detector per branch,
             # so we insert it in the first point on the branch.
-            point = (loc[1], 0)
-            cell.insert_transmitter(gid, point, source=self.source)
+            point = (branch, 0)
+            cell.insert_transmitter(int(gid), point, source=self.source)
 
     def create_receivers(self, simdata: "NeuronSimulationData", cs: "ConnectivitySet"):
         for post_cm, post_pop in simdata.populations.items():
@@ -76,23 +253,283 @@ class TransceiverModel(NeuronConnection, classmap_entry="transceiver"):
                 break
         else:
             raise AdapterError(f"No pop found for {cs.pre_type.name}")
-        pre, post = cs.load_connections().incoming().to(simdata.chunks).all()
-        transmitters = simdata.transmap[self]["receivers"]
-        for pre_loc, post_loc in zip(pre[:, :2], post):
-            gid = transmitters[tuple(pre_loc)]
-            cell = post_pop[post_loc[0]]
-            for spec in self.synapses:
-                cell.insert_receiver(
-                    gid,
+        itr = cs.load_connections().incoming().to(simdata.chunks)
+        placement = {}
+        # The connections are loaded in blocks of whole postsynaptic chunks, or parts of
+        # them, so that each cell receives its synapses in the same blocks on any rank.
+        for pre, post in _iter_batches(
+            itr.chunk_iter(), self.simulation.connection_block_size, by_post_chunk=True
+        ):
+            self._create_receiver_block(simdata, cs, post_pop, pre, post, placement)
+
+    def _create_receiver_block(self, simdata, cs, post_pop, pre, post, placement):
+        from arborize.builders._neuron import NeuronModel
+
+        gids = simdata.transmap[self]["receivers"].lookup(pre)
+        # Sort the connections by cell and location, so that each cell receives all of
+        # its synapses of a type of the block at once.
+        order = np.lexsort(post.T[::-1])
+        pre, post, gids = pre[order], post[order], gids[order]
+        # The presynaptic cell ids are global, the postsynaptic ids local.
+        connections = ConnectionData(
+            cs,
+            pre,
+            post,
+            post_chunks=simdata.chunks,
+            streams=simdata.streams,
+            placement=placement,
+        )
+        values = [
+            (
+                spec.weight.resolve(connections),
+                spec.delay.resolve(connections),
+                {k: v.resolve(connections) for k, v in spec.attributes.items()},
+            )
+            for spec in self.synapses
+        ]
+        cell_ids, starts = np.unique(post[:, 0], return_index=True)
+        stops = np.append(starts[1:], len(post))
+        for cell_id, start, stop in zip(cell_ids.tolist(), starts, stops):
+            cell = post_pop[cell_id]
+            insert = getattr(cell, "insert_receivers", None)
+            if insert is None:
+                # Only the cells that arborize builds are known to insert their receivers
+                # like `insert_receivers`, other cells receive their connections 1 by 1.
+                insert = functools.partial(
+                    (
+                        insert_receivers
+                        if isinstance(cell, NeuronModel)
+                        else _insert_each_receiver
+                    ),
+                    cell,
+                )
+            for spec, (weights, delays, attributes) in zip(self.synapses, values):
+                args = (
+                    gids[start:stop],
                     spec.synapse,
-                    post_loc[1:],
+                    post[start:stop, 1:],
+                    weights[start:stop],
+                    delays[start:stop],
+                )
+                kwargs = dict(
                     source=self.source,
-                    weight=spec.weight,
-                    delay=spec.delay,
+                    attributes={k: v[start:stop] for k, v in attributes.items()},
                 )
+                insert(*args, **kwargs)
 
     def __lt__(self, other):
         try:
             return self.name < other.name
         except Exception:
             return True
+
+
+@config.node
+class GapJunctionModel(NeuronConnection, classmap_entry="gap_junction"):
+    """
+    Electrical coupling between the pre- and postsynaptic location of each connection.
+    A gap junction is inserted on both sides, and its ``variable`` receives the voltage
+    of the other side, across ranks, through NEURON's transfer of source variables.
+    """
+
+    synapse = config.attr(type=str, required=True)
+    """Synapse type of the gap junctions, on both cell models."""
+    variable = config.attr(type=str, default="vgap")
+    """Variable of the gap junctions that receives the voltage of the other side."""
+    attributes = config.dict(type=ConnectionValue)
+    """Parameters of the gap junctions, such as their conductance, set for each
+    connection. Both gap junctions of a connection get the same values."""
+    parameters = config.list(type=Parameter)
+    spiking = False
+
+    def count_source_ids(self, cs):
+        # The voltage of both sides of each connection.
+        return 2 * _count_connections(cs)
+
+    def create_connections(self, simulation, simdata, cs):
+        first = simdata.source_ids[self].start
+        pre_pop = _get_population(simdata, cs.pre_type)
+        post_pop = _get_population(simdata, cs.post_type)
+        # Each connection is numbered by its position in the connectivity set, so that
+        # the ranks of both sides agree on the ids of their voltages. All ranks stream
+        # through the same blocks of the connectivity set.
+        our_chunks = set(simdata.chunks)
+        pre_shift = _scoping_shift(cs.pre_type, simdata.chunks)
+        post_shift = _scoping_shift(cs.post_type, simdata.chunks)
+        placement = {}
+        start = first
+        for pre, post, pre_ours, post_ours in _iter_batches(
+            cs.load_connections().as_globals().chunk_iter(),
+            simulation.connection_block_size,
+            our_chunks=our_chunks,
+        ):
+            attributes = self._resolve_attributes(
+                ConnectionData(
+                    cs, pre, post, streams=simdata.streams, placement=placement
+                )
+            )
+            sids = start + 2 * np.arange(len(pre))
+            start += 2 * len(pre)
+            pre_ids = pre_shift.to_scoped_ids(pre[:, 0])
+            post_ids = post_shift.to_scoped_ids(post[:, 0])
+            for i in np.flatnonzero(pre_ours).tolist():
+                self._insert_gap_junction(
+                    pre_pop[pre_ids[i]], pre[i, 1:], sids[i], sids[i] + 1, attributes, i
+                )
+            for i in np.flatnonzero(post_ours).tolist():
+                self._insert_gap_junction(
+                    post_pop[post_ids[i]],
+                    post[i, 1:],
+                    sids[i] + 1,
+                    sids[i],
+                    attributes,
+                    i,
+                )
+
+    def _resolve_attributes(self, connections):
+        # Random values are drawn once, so that both sides of a connection agree.
+        return MPI.bcast(
+            {k: v.resolve(connections) for k, v in self.attributes.items()}
+            if MPI.get_rank() == 0
+            else None
+        )
+
+    def _insert_gap_junction(self, cell, loc, source_id, target_id, attributes, i):
+        from patch import p
+
+        loc = tuple(loc.tolist())
+        la = cell.get_location(loc)
+        p.parallel.source_var(
+            cell.get_segment(loc)._ref_v, int(source_id), sec=la.section.__neuron__()
+        )
+        gap = cell.insert_synapse(self.synapse, loc)
+        for attribute, values in attributes.items():
+            gap.set_parameter(attribute, values[i])
+        spp = gap._pp
+        p.parallel.target_var(spp, getattr(spp, "_ref_" + self.variable), int(target_id))
+
+
+def _iter_batches(blocks, size, by_post_chunk=False, our_chunks=None):
+    """
+    Concatenate the blocks of a connection iterator into batches, that are closed once
+    they reach ``size`` connections. Blocks are never split.
+
+    :param blocks: Presynaptic chunk, presynaptic locations, postsynaptic chunk and
+      postsynaptic locations of each block.
+    :param by_post_chunk: Don't merge blocks of different postsynaptic chunks.
+    :param our_chunks: If given, the batches also flag which connections have their pre-
+      and postsynaptic cell in these chunks.
+    :returns: The presynaptic and postsynaptic locations of each batch, and the flags.
+    """
+    batch, count, post_chunk = [], 0, None
+    for block in blocks:
+        if batch and (count >= size or (by_post_chunk and block[2] != post_chunk)):
+            yield _concat_batch(batch, our_chunks)
+            batch, count = [], 0
+        batch.append(block)
+        count += len(block[1])
+        post_chunk = block[2]
+    if batch:
+        yield _concat_batch(batch, our_chunks)
+
+
+def _concat_batch(batch, our_chunks):
+    pre = np.concatenate([block[1] for block in batch])
+    post = np.concatenate([block[3] for block in batch])
+    if our_chunks is None:
+        return pre, post
+    pre_ours, post_ours = (
+        np.concatenate(
+            [np.full(len(block[1]), block[side] in our_chunks) for block in batch]
+        )
+        for side in (0, 2)
+    )
+    return pre, post, pre_ours, post_ours
+
+
+def _count_connections(cs):
+    try:
+        stats = cs.get_chunk_stats()
+    except AttributeError:
+        # Engines that don't store the connection counts per chunk have to count them.
+        return len(cs)
+    return sum(counts["out"] for counts in stats.values())
+
+
+def _get_population(simdata, cell_type):
+    for cell_model, pop in simdata.populations.items():
+        if cell_model.cell_type == cell_type:
+            return pop
+    raise AdapterError(f"No pop found for {cell_type.name}")
+
+
+def insert_receivers(
+    cell, gids, label, locations, weights, delays, source=None, attributes=None
+):
+    """
+    Insert a synapse of type ``label`` on an arborized ``cell`` for each connection, and
+    connect it to the transmitter with its GID. The connections must be sorted by
+    location. Cell models can implement the same signature as their own
+    ``insert_receivers`` method.
+
+    :param gids: GID of the transmitter of each connection.
+    :param label: Synapse type.
+    :param locations: Branch and point of each connection on the cell.
+    :param weights: Weight of each connection.
+    :param delays: Delay of each connection.
+    :param source: Variable to receive from the transmitter, instead of its spikes.
+    :param attributes: Value of each connection for parameters of the synapse.
+    :type attributes: dict[str, numpy.ndarray]
+    """
+    import glia
+    from patch import p
+
+    gids, weights, delays = gids.tolist(), weights.tolist(), delays.tolist()
+    attributes = {k: v.tolist() for k, v in (attributes or {}).items()}
+    bounds = (np.flatnonzero(np.any(np.diff(locations, axis=0), axis=1)) + 1).tolist()
+    for start, stop in zip([0, *bounds], [*bounds, len(gids)]):
+        # All the connections on this location share its section and synapse type.
+        loc = tuple(locations[start].tolist())
+        la = cell.get_location(loc)
+        synapse = (la.section.synapse_types or {}).get(label)
+        if synapse is None:
+            # Let the cell raise its error for the unknown synapse type.
+            cell.insert_synapse(label, loc)
+        x = la.arc(0.5)
+        segment = None
+        for i in range(start, stop):
+            if segment is None:
+                mech = glia.insert(la.section, *synapse.mech_id, x=x)
+                # The other synapses reuse the mechanism resolved by glia and the
+                # segment, patch stores a reference on the section for each segment.
+                mod = mech._mod
+                point_process = getattr(p, mod.mod_name)
+                segment = la.section(x)
+            else:
+                mech = glia.MechAccessor(la.section, mod, point_process(segment))
+            mech.set(synapse.parameters)
+            for attribute, values in attributes.items():
+                mech.set_parameter(attribute, values[i])
+            mech.synapse_name = label
+            mech.gid = gids[i]
+            la.section.synapses.append(mech)
+            if source is None:
+                p.ParallelCon(gids[i], mech, weight=weights[i], delay=delays[i])
+            else:
+                spp = mech._pp
+                p.parallel.target_var(spp, getattr(spp, "_ref_" + source), gids[i])
+
+
+def _insert_each_receiver(
+    cell, gids, label, locations, weights, delays, source=None, attributes=None
+):
+    attributes = {k: v.tolist() for k, v in (attributes or {}).items()}
+    for i, (gid, loc, weight, delay) in enumerate(
+        zip(gids.tolist(), locations, weights.tolist(), delays.tolist())
+    ):
+        kwargs = (
+            {"attributes": {k: v[i] for k, v in attributes.items()}} if attributes else {}
+        )
+        cell.insert_receiver(
+            gid, label, loc, source=source, weight=weight, delay=delay, **kwargs
+        )
@@ -4,3 +4,43 @@ from bsb import DeviceModel, Targetting, config
 @config.dynamic(attr_name="device", auto_classmap=True)
 class NeuronDevice(DeviceModel):
     targetting = config.attr(type=Targetting, required=True)
+
+    def iter_locations(self, adapter, simulation, simdata):
+        """
+        Iterate over the locations of the targets of a device with ``locations``. The
+        locations are resolved once for all the cells that share a morphology.
+
+        :returns: Pairs of a target and one of its locations.
+        """
+        cache = {}
+        for model, pop in self.targetting.get_targets(
+            adapter, simulation, simdata
+        ).items():
+            for target in pop:
+                for location in self._get_locations(target, cache):
+                    yield target, location
+
+    def _get_locations(self, target, cache):
+        morphology = getattr(target, "morphology", None)
+        if morphology is None:
+            return self.locations.get_locations(target)
+        try:
+            keys = cache[id(morphology)]
+        except KeyError:
+            keys = cache[id(morphology)] = [
+                location._loc for location in self.locations.get_locations(target)
+            ]
+        return [target.locations[key] for key in keys]
+
+    def add_teardown(self, simdata, undo):
+        """
+        Register a function that undoes a change this device made to the network.
+        """
+        simdata.devices.setdefault(self, []).append(undo)
+
+    def teardown(self, adapter, simulation, simdata):
+        """
+        Remove this device from the network, so that the network can be run again.
+        """
+        for undo in simdata.devices.pop(self, ()):
+            undo()
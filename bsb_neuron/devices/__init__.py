@@ -1,6 +1,7 @@
 from .current_clamp import CurrentClamp
 from .ion_recorder import IonRecorder
 from .spike_generator import SpikeGenerator
+from .spike_recorder import SpikeRecorder
 from .synapse_recorder import SynapseRecorder
 from .voltage_clamp import VoltageClamp
 from .voltage_recorder import VoltageRecorder
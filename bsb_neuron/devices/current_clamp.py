@@ -1,3 +1,5 @@
+import functools
+
 from bsb import LocationTargetting, config, warn
 
 from ..device import NeuronDevice
@@ -11,26 +13,26 @@ class CurrentClamp(NeuronDevice, classmap_entry="current_clamp"):
     duration = config.attr(type=float, default=None)
 
     def implement(self, adapter, simulation, simdata):
-        for model, pop in self.targetting.get_targets(
-            adapter, simulation, simdata
-        ).items():
-            for target in pop:
-                clamped = False
-                for location in self.locations.get_locations(target):
-                    if clamped:
-                        warn(f"Multiple current clamps placed on {target}")
-                    self._add_clamp(
-                        simdata,
-                        location,
-                        name=self.name,
-                        cell_type=target.cell_model.name,
-                        cell_id=target.id,
-                    )
-                    clamped = True
+        clamped = None
+        for target, location in self.iter_locations(adapter, simulation, simdata):
+            if target is clamped:
+                warn(f"Multiple current clamps placed on {target}")
+            self._add_clamp(
+                simdata,
+                location,
+                channel=dict(
+                    cell_type=target.cell_model.name,
+                    cell_id=target.id,
+                    location=str(location._loc),
+                ),
+                name=self.name,
+            )
+            clamped = target
 
     def _add_clamp(self, simdata, location, **annotations):
         sx = location.arc(0.5)
         clamp = location.section.iclamp(
             x=sx, delay=self.before, duration=self.duration, amplitude=self.amplitude
         )
+        self.add_teardown(simdata, functools.partial(location.section.__deref__, clamp))
         simdata.result.record(clamp._ref_i, **annotations, units="nA")
@@ -1,20 +1,181 @@
+import abc
+import functools
+import zlib
+
+import numpy as np
 from bsb import LocationTargetting, config, types
 
 from ..device import NeuronDevice
 
 
+def _positive_float(value):
+    v = types.float()(value)
+    if v <= 0:
+        raise TypeError(f"Could not cast {value} to a float > 0.")
+    return v
+
+
+_positive_float.__name__ = "float > 0"
+
+
+@config.dynamic(attr_name="type", auto_classmap=True, required=True)
+class SpikePattern(abc.ABC):
+    """
+    Spike times that are generated in advance and played into the synapses.
+    """
+
+    @abc.abstractmethod
+    def generate(self, rng, simulation):
+        """
+        Generate the spike times of a spike train.
+
+        :param rng: Random number generator of the spike train.
+        :type rng: numpy.random.Generator
+        :returns: Sorted spike times, in ms.
+        :rtype: numpy.ndarray
+        """
+        pass
+
+    def _time_window(self, simulation):
+        stop = simulation.duration if self.stop is None else self.stop
+        return self.start, stop
+
+
+@config.node
+class PoissonPattern(SpikePattern, classmap_entry="poisson"):
+    rate = config.attr(type=types.float(min=0), required=True)
+    """Mean spike rate, in Hz."""
+    start = config.attr(type=float, default=0.0)
+    stop = config.attr(type=float, default=None)
+    """Time of the end of the spike train. By default the end of the simulation."""
+
+    def generate(self, rng, simulation):
+        start, stop = self._time_window(simulation)
+        count = rng.poisson(self.rate * max(stop - start, 0) / 1000)
+        return np.sort(rng.uniform(start, stop, count))
+
+
+@config.node
+class RegularPattern(SpikePattern, classmap_entry="regular"):
+    interval = config.attr(type=_positive_float, required=True)
+    """Time between 2 spikes, in ms."""
+    start = config.attr(type=float, default=0.0)
+    stop = config.attr(type=float, default=None)
+    """Time of the end of the spike train. By default the end of the simulation."""
+
+    def generate(self, rng, simulation):
+        return np.arange(*self._time_window(simulation), self.interval)
+
+
+@config.node
+class FilePattern(SpikePattern, classmap_entry="file"):
+    path = config.attr(type=str, required=True)
+    """Text file with the spike times of a spike train on each line."""
+
+    @functools.cached_property
+    def trains(self):
+        with open(self.path) as f:
+            return [np.sort(np.array(line.split(), dtype=float)) for line in f]
+
+    def generate(self, rng, simulation):
+        return self.trains[rng.integers(len(self.trains))]
+
+
 @config.node
 class SpikeGenerator(NeuronDevice, classmap_entry="spike_generator"):
     locations = config.attr(type=LocationTargetting, default={"strategy": "soma"})
     synapses = config.list()
+    pattern = config.attr(type=SpikePattern, default=None)
+    """
+    Spike times to play into the synapses. Without a pattern, each synapse is stimulated
+    by its own NetStim.
+    """
+    sources = config.attr(type=types.int(min=1), default=None)
+    """
+    Number of spike trains of the pattern, that each synapse picks 1 of at random. By
+    default, each target cell gets its own spike train, shared by its synapses.
+    """
+    seed = config.attr(type=types.int(min=0), default=None)
+    """Seed of the spike trains of the pattern. By default, the seed of the simulation."""
     parameters = config.catch_all(type=types.any_())
 
     def implement(self, adapter, simulation, simdata):
-        for model, pop in self.targetting.get_targets(
-            adapter, simulation, simdata
-        ).items():
+        if self.pattern is not None:
+            return self._implement_pattern(adapter, simulation, simdata)
+        streams = simdata.streams
+        targets = self.targetting.get_targets(adapter, simulation, simdata)
+        cache = {}
+        for model, pop in targets.items():
             for target in pop:
-                for location in self.locations.get_locations(target):
+                # Each NetStim of a cell gets its own stream, numbered on the cell.
+                index = 0
+                for location in self._get_locations(target, cache):
                     for synapse in location.section.synapses:
-                        if not self.synapses or synapse.synapse_name in self.synapses:
-                            synapse.stimulate(**self.parameters)
+                        if self.synapses and synapse.synapse_name not in self.synapses:
+                            continue
+                        stimulus = synapse.stimulate(**self.parameters)
+                        if hasattr(stimulus.__neuron__(), "noiseFromRandom123"):
+                            stimulus.noiseFromRandom123(
+                                *streams.ids(self, model, target.id, index)
+                            )
+                            index += 1
+                        self.add_teardown(
+                            simdata, functools.partial(_disconnect, synapse, stimulus)
+                        )
+
+    def _implement_pattern(self, adapter, simulation, simdata):
+        from patch import p
+
+        # Each source plays a spike train from its own random stream, so that every rank
+        # can create the sources its synapses need, without exchanging their spikes.
+        seed = self.seed if self.seed is not None else simdata.streams.seed
+        weight = self.parameters.get("weight", 0.04)
+        delay = self.parameters.get("delay", 0.0)
+        name = zlib.crc32(self.name.encode())
+        sources = {}
+
+        def get_source(key):
+            try:
+                return sources[key]
+            except KeyError:
+                times = self.pattern.generate(np.random.default_rng(key), simulation)
+                vector = p.Vector(times)
+                stimulus = p.VecStim()
+                stimulus.play(vector.__neuron__())
+                # The VecStim doesn't keep a reference to the vector it plays.
+                stimulus._vector = vector
+                sources[key] = stimulus
+                return stimulus
+
+        targets = self.targetting.get_targets(adapter, simulation, simdata)
+        cache = {}
+        for model, pop in targets.items():
+            model_key = zlib.crc32(model.name.encode())
+            for target in pop:
+                cell_key = [seed, name, model_key, target.id]
+                picks = None if self.sources is None else np.random.default_rng(cell_key)
+                # Locations can share a section, so connect each synapse only once.
+                connected = set()
+                for location in self._get_locations(target, cache):
+                    for synapse in location.section.synapses:
+                        if self.synapses and synapse.synapse_name not in self.synapses:
+                            continue
+                        if id(synapse._pp) in connected:
+                            continue
+                        connected.add(id(synapse._pp))
+                        if picks is None:
+                            stimulus = get_source(tuple(cell_key))
+                        else:
+                            source = int(picks.integers(self.sources))
+                            stimulus = get_source((seed, name, source))
+                        p.NetCon(stimulus, synapse._pp, weight=weight, delay=delay)
+                        self.add_teardown(
+                            simdata,
+                            functools.partial(_disconnect, synapse, stimulus),
+                        )
+
+
+def _disconnect(synapse, stimulus):
+    connection = synapse._connections.pop(stimulus)
+    stimulus._connections.pop(getattr(synapse, "_pp", synapse), None)
+    connection.active(False)
@@ -0,0 +1,98 @@
+import numpy as np
+from bsb import LocationTargetting, config
+from neo import SpikeTrain
+
+from ..device import NeuronDevice
+
+
+@config.node
+class SpikeRecorder(NeuronDevice, classmap_entry="spike_recorder"):
+    locations = config.attr(type=LocationTargetting, default={"strategy": "soma"})
+    threshold = config.attr(type=float, default=-20.0)
+    """Spike detection threshold in mV, for locations without a transmitter."""
+
+    def implement(self, adapter, simulation, simdata):
+        from patch import p
+
+        # All the spikes of this device on this rank are recorded as 1 pair of time and
+        # id vectors. Locations with a transmitter are identified by their GID, the
+        # others by a negative detector id.
+        times = p.Vector()
+        ids = p.Vector()
+        keys = []
+        recorded_gids = set()
+        channels = []
+        detectors = []
+        for target, location in self.iter_locations(adapter, simulation, simdata):
+            transmitter = getattr(location.section, "_transmitter", None)
+            if transmitter is not None:
+                key = transmitter.gid
+                if key in recorded_gids:
+                    continue
+                recorded_gids.add(key)
+                p.parallel.spike_record(key, times, ids)
+            else:
+                key = -1 - len(detectors)
+                detectors.append(
+                    p.NetCon(
+                        location.section(location.arc(0.5)),
+                        None,
+                        threshold=self.threshold,
+                    )
+                )
+            keys.append(key)
+            channels.append(
+                dict(
+                    cell_type=target.cell_model.name,
+                    cell_id=target.id,
+                    location=str(location._loc),
+                )
+            )
+        if simulation.coreneuron:
+            # CoreNEURON only records the spikes of GIDs.
+            gids = adapter.allocate_gids(len(detectors))
+            for gid, detector in zip(gids, detectors):
+                p.parallel.set_gid2node(gid, p.parallel.id())
+                p.parallel.cell(gid, detector)
+                p.parallel.spike_record(gid, times, ids)
+            keys = [gids[-1 - key] if key < 0 else key for key in keys]
+        else:
+            for i, detector in enumerate(detectors):
+                detector.__neuron__().record(times.__neuron__(), ids.__neuron__(), -1 - i)
+
+        # Copy of the spikes, made when the recorder is removed from the network.
+        recorded = []
+
+        def teardown():
+            # GIDs can't stop being recorded, so copy the spikes recorded so far and
+            # empty the vectors.
+            recorded.append((times.as_numpy().copy(), ids.as_numpy().copy()))
+            times.resize(0)
+            ids.resize(0)
+            detectors.clear()
+
+        self.add_teardown(simdata, teardown)
+
+        def flush(segment):
+            # The detectors only had to be kept alive during the run.
+            detectors.clear()
+            spike_times, spike_ids = (
+                recorded[0] if recorded else (times.as_numpy(), ids.as_numpy())
+            )
+            order = np.argsort(spike_ids, kind="stable")
+            sorted_ids = spike_ids[order]
+            spike_times = spike_times[order]
+            starts = np.searchsorted(sorted_ids, keys, side="left")
+            stops = np.searchsorted(sorted_ids, keys, side="right")
+            for start, stop, channel in zip(starts, stops, channels):
+                segment.spiketrains.append(
+                    SpikeTrain(
+                        spike_times[start:stop],
+                        units="ms",
+                        t_stop=simulation.duration,
+                        name=self.name,
+                        **channel,
+                    )
+                )
+
+        simdata.result.create_recorder(flush)
@@ -1,4 +1,4 @@
-from bsb import LocationTargetting, config
+from bsb import LocationTargetting, config, types
 
 from ..device import NeuronDevice
 
@@ -7,26 +7,31 @@ from ..device import NeuronDevice
 class SynapseRecorder(NeuronDevice, classmap_entry="synapse_recorder"):
     locations = config.attr(type=LocationTargetting, required=True)
     synapse_types = config.list()
+    sampling_interval = config.attr(type=types.float(min=0.0), default=None)
+    """Time between samples in ms. Samples every time step by default."""
+    start = config.attr(type=float, default=None)
+    """Time of the first sample in ms."""
+    stop = config.attr(type=float, default=None)
+    """Time of the last sample in ms."""
 
     def implement(self, adapter, simulation, simdata):
-        for model, pop in self.targetting.get_targets(
-            adapter, simulation, simdata
-        ).items():
-            for target in pop:
-                for location in self.locations.get_locations(target):
-                    for synapse in location.section.synapses:
-                        if (
-                            not self.synapse_types
-                            or synapse.synapse_name in self.synapse_types
-                        ):
-                            _record_synaptic_current(
-                                simdata.result,
-                                synapse,
-                                name=self.name,
-                                cell_type=target.cell_model.name,
-                                cell_id=target.id,
-                                synapse_type=synapse.synapse_name,
-                            )
+        for target, location in self.iter_locations(adapter, simulation, simdata):
+            for synapse in location.section.synapses:
+                if not self.synapse_types or synapse.synapse_name in self.synapse_types:
+                    _record_synaptic_current(
+                        simdata.result,
+                        synapse,
+                        channel=dict(
+                            cell_type=target.cell_model.name,
+                            cell_id=target.id,
+                            location=str(location._loc),
+                            synapse_type=synapse.synapse_name,
+                        ),
+                        name=self.name,
+                        sampling_interval=self.sampling_interval,
+                        start=self.start,
+                        stop=self.stop,
+                    )
 
 
 def _record_synaptic_current(result, synapse, **annotations):
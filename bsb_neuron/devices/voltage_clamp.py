@@ -1,3 +1,4 @@
+import functools
 import warnings
 
 from bsb import LocationTargetting, config, types
@@ -17,21 +18,20 @@ class VoltageClamp(NeuronDevice, classmap_entry="vclamp"):
     holding = config.attr(type=float, default=None)
 
     def implement(self, adapter, simulation, simdata):
-        for target in self.targetting.get_targets(adapter, simulation, simdata):
-            clamped = False
-            for location in self.locations.get_locations(target):
-                if clamped:
-                    warnings.warn(f"Multiple voltage clamps placed on {target}")
-                self._add_clamp(
-                    simdata.results,
-                    location,
-                    name=self.name,
-                    cell_type=target.cell_model.name,
-                    cell_id=target.id,
-                )
-                clamped = True
+        clamped = None
+        for target, location in self.iter_locations(adapter, simulation, simdata):
+            if target is clamped:
+                warnings.warn(f"Multiple voltage clamps placed on {target}")
+            self._add_clamp(
+                simdata,
+                location,
+                name=self.name,
+                cell_type=target.cell_model.name,
+                cell_id=target.id,
+            )
+            clamped = target
 
-    def _add_clamp(self, results, location, **annotations):
+    def _add_clamp(self, simdata, location, **annotations):
         sx = location.arc(0.5)
         clamp = location.section.vclamp(
             voltage=self.voltage,
@@ -42,4 +42,5 @@ class VoltageClamp(NeuronDevice, classmap_entry="vclamp"):
                 if (v := getattr(self, k)) is not None
             },
         )
-        results.record(clamp, **annotations)
+        self.add_teardown(simdata, functools.partial(location.section.__deref__, clamp))
+        simdata.result.record(clamp._ref_i, **annotations)
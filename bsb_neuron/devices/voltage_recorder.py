@@ -1,4 +1,4 @@
-from bsb import LocationTargetting, config
+from bsb import LocationTargetting, config, types
 
 from ..device import NeuronDevice
 
@@ -6,20 +6,28 @@ from ..device import NeuronDevice
 @config.node
 class VoltageRecorder(NeuronDevice, classmap_entry="voltage_recorder"):
     locations = config.attr(type=LocationTargetting, default={"strategy": "soma"})
+    sampling_interval = config.attr(type=types.float(min=0.0), default=None)
+    """Time between samples in ms. Samples every time step by default."""
+    start = config.attr(type=float, default=None)
+    """Time of the first sample in ms."""
+    stop = config.attr(type=float, default=None)
+    """Time of the last sample in ms."""
 
     def implement(self, adapter, simulation, simdata):
-        for model, pop in self.targetting.get_targets(
-            adapter, simulation, simdata
-        ).items():
-            for target in pop:
-                for location in self.locations.get_locations(target):
-                    self._add_voltage_recorder(
-                        simdata.result,
-                        location,
-                        name=self.name,
-                        cell_type=target.cell_model.name,
-                        cell_id=target.id,
-                    )
+        for target, location in self.iter_locations(adapter, simulation, simdata):
+            self._add_voltage_recorder(
+                simdata.result,
+                location,
+                channel=dict(
+                    cell_type=target.cell_model.name,
+                    cell_id=target.id,
+                    location=str(location._loc),
+                ),
+                name=self.name,
+                sampling_interval=self.sampling_interval,
+                start=self.start,
+                stop=self.stop,
+            )
 
     def _add_voltage_recorder(self, results, location, **annotations):
         section = location.section
@@ -0,0 +1,134 @@
+import contextlib
+import cProfile
+import os
+import sys
+import time
+
+from bsb import MPI, config, report
+
+
+@config.node
+class ProfilingSettings:
+    """
+    Settings of the profiling of the setup of the network.
+    """
+
+    cprofile_directory = config.attr(type=str, default=None)
+    """Directory to dump the cProfile statistics of the setup of each rank to."""
+
+
+class SetupProfile:
+    """
+    Times the phases of the setup of a simulation, and of each model in them, on this
+    rank, and measures how much they raise the peak memory of the rank. Does nothing
+    unless enabled.
+    """
+
+    def __init__(self, simulation):
+        self.settings = simulation.profiling
+        self.timings = {}
+        self.memory = {}
+        self.counts = {}
+        self._profiler = None
+        self._path = None
+        if self.enabled and self.settings.cprofile_directory is not None:
+            self._path = os.path.join(
+                self.settings.cprofile_directory,
+                f"{simulation.name}_setup_{MPI.get_rank()}.prof",
+            )
+
+    @property
+    def enabled(self):
+        return self.settings is not None
+
+    @contextlib.contextmanager
+    def phase(self, name, model=None):
+        """
+        Time the code in this context as the ``name`` phase, or as the ``model`` of the
+        ``name`` phase.
+        """
+        if not self.enabled:
+            yield
+            return
+        key = name if model is None else f"{name}.{model.name}"
+        peak = _peak_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[key] = self.timings.get(key, 0.0) + time.perf_counter() - start
+            self.memory[key] = self.memory.get(key, 0.0) + _peak_memory() - peak
+
+    def start(self):
+        if self._path is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            self._profiler.dump_stats(self._path)
+            self._profiler = None
+
+    def count(self, simdata):
+        """
+        Count the cells, synapses and transmitters of the network on this rank, and the
+        sections and NetCons in NEURON.
+        """
+        from neuron import h
+
+        self.counts = {
+            "cells": sum(len(pop) for pop in simdata.populations.values()),
+            "sections": sum(1 for _ in h.allsec()),
+            "synapses": sum(
+                len(getattr(section, "synapses", ()))
+                for pop in simdata.populations.values()
+                for cell in pop
+                for section in getattr(cell, "sections", ())
+            ),
+            "netcons": int(h.List("NetCon").count()),
+            "transmitters": sum(
+                len(maps["transmitters"]) for maps in simdata.transmap.values()
+            ),
+        }
+
+    def gather(self):
+        """
+        Gather the timings and counts of all ranks. Has to be called collectively.
+
+        :returns: The timings and counts of each rank.
+        :rtype: list[dict]
+        """
+        return MPI.allgather(
+            {"timings": self.timings, "memory": self.memory, "counts": self.counts}
+        )
+
+
+def _peak_memory():
+    # Peak resident memory of the process in MB, or 0 where it can't be measured.
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, macOS bytes.
+    return peak / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def report_profile(ranks):
+    """
+    Report the minimum, mean and maximum over the ranks of each timing, memory raise and
+    count.
+    """
+    for kind, unit in (("timings", "s"), ("memory", "MB"), ("counts", "")):
+        for key in ranks[0][kind].keys():
+            values = [rank[kind].get(key, 0) for rank in ranks]
+            report(
+                f"{key}: min {min(values):.3g}{unit}, mean"
+                f" {sum(values) / len(values):.3g}{unit}, max {max(values):.3g}{unit}",
+                level=2,
+            )
+
+
+__all__ = ["ProfilingSettings", "SetupProfile"]
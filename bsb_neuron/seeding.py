@@ -0,0 +1,85 @@
+import zlib
+
+import numpy as np
+
+
+class RandomStreams:
+    """
+    Random streams of a simulation. Each stream is identified by the seed of the
+    simulation and by keys that don't depend on the ranks, such as the configuration
+    node that uses it, cell ids and GIDs, so that the results are the same for any number
+    of ranks or threads.
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+
+    @classmethod
+    def from_simulation(cls, simulation):
+        """
+        Get the streams of a simulation. Without a seed, the streams of seed 0 are used,
+        so that the results are reproducible.
+        """
+        return cls(0 if simulation.seed is None else simulation.seed)
+
+    def install(self):
+        """
+        Make the seed the global index of NEURON's Random123 generators.
+        """
+        from neuron import h
+
+        h.Random().Random123_globalindex(self.seed)
+
+    def ids(self, node, model, cell_id, index=0):
+        """
+        Get the Random123 ids of a stream of a cell.
+
+        :param node: Configuration node that uses the stream, such as a device.
+        :param model: Cell model of the cell.
+        :param cell_id: Id of the cell.
+        :param index: Index of the stream on the cell.
+        """
+        return _key(node, model), int(cell_id), int(index)
+
+    def uniform(self, node, keys):
+        """
+        Get a uniform random value in [0, 1) for each row of integer ``keys``, without
+        drawing them in order.
+        """
+        keys = np.asarray(keys).astype(np.uint64, copy=False).reshape(len(keys), -1)
+        values = np.full(len(keys), _mix(np.uint64(self.seed) ^ np.uint64(_key(node))))
+        for column in keys.T:
+            values = _mix(values ^ column)
+        return (values >> np.uint64(11)).astype(float) * 2.0**-53
+
+    def seed_cells(self, populations):
+        """
+        Give each stochastic point process on the cells its own stream. Point processes
+        are stochastic if they have a ``noiseFromRandom123`` method, like NetStims.
+        """
+        for model, pop in populations.items():
+            for cell in pop:
+                index = 0
+                for section in getattr(cell, "sections", ()):
+                    for synapse in getattr(section, "synapses", ()):
+                        pp = synapse._pp.__neuron__()
+                        if hasattr(pp, "noiseFromRandom123"):
+                            pp.noiseFromRandom123(*self.ids(model, None, cell.id, index))
+                        index += 1
+
+
+def _key(*nodes):
+    name = "".join(node.get_node_name() for node in nodes if node is not None)
+    return zlib.crc32(name.encode())
+
+
+def _mix(values):
+    # Finalizer of the splitmix64 generator.
+    with np.errstate(over="ignore"):
+        values = values + np.uint64(0x9E3779B97F4A7C15)
+        values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+__all__ = ["RandomStreams"]
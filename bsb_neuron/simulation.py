@@ -1,8 +1,22 @@
 from bsb import Simulation, config, types
 
+from .balancing import LoadBalancing
 from .cell import NeuronCell
 from .connection import NeuronConnection
 from .device import NeuronDevice
+from .profiling import ProfilingSettings
+
+
+@config.node
+class CVodeSettings:
+    """
+    Settings of NEURON's variable time step integrator.
+    """
+
+    local = config.attr(type=bool, default=False)
+    """Integrate each cell with its own time step."""
+    atol = config.attr(type=types.float(min=0.0), default=1e-3)
+    """Absolute error tolerance."""
 
 
 @config.node
@@ -18,3 +32,64 @@ class NeuronSimulation(Simulation):
     cell_models = config.dict(type=NeuronCell, required=True)
     connection_models = config.dict(type=NeuronConnection, required=True)
     devices = config.dict(type=NeuronDevice, required=True)
+    load_balancing = config.attr(type=LoadBalancing, default={"strategy": "round_robin"})
+    transceiver_cache = config.attr(type=bool, default=False)
+    schematic_workers = config.attr(type=types.int(min=0), default=0)
+    """
+    Number of processes that build the schematics of the morphologies of each population
+    in parallel. The workers are spawned as fresh interpreters, outside of the MPI job,
+    since forking would copy the MPI and NEURON state of the rank into them.
+    """
+    connection_block_size = config.attr(type=types.int(min=1), default=1_000_000)
+    """
+    Number of connections to load at once while connecting the network. The connections
+    between 2 chunks are loaded together, so a block can be larger if they are.
+    """
+    flush_interval = config.attr(type=types.float(min=0.0), default=None)
+    flush_directory = config.attr(type=str, default=None)
+    psolve_interval = config.attr(type=types.float(min=0.0), default=1.0)
+    """
+    Time in ms between the returns of NEURON's solver, to drain and report progress. If
+    0, the whole simulation is solved at once.
+    """
+    maxstep = config.attr(type=types.float(min=0.0), default=None)
+    """
+    Maximum time in ms between spike exchanges. By default, the minimum delay of the
+    network's connections.
+    """
+    spike_compress = config.attr(type=types.int(min=0), default=0)
+    """
+    Number of spikes that fit in the compressed buffers of each spike exchange between
+    the ranks. 0 exchanges uncompressed spikes. Only for fixed time steps.
+    """
+    progress_interval = config.attr(type=types.float(min=0.0), default=None)
+    """Time in ms between progress reports. By default, every solver return."""
+    threads = config.attr(type=types.int(min=1), default=1)
+    """Number of threads per MPI rank."""
+    thread_partitioning = config.attr(
+        type=types.in_(["auto", "balanced"]), default="auto"
+    )
+    """
+    How cells are divided over the threads: by NEURON, or balanced by their number of
+    segments.
+    """
+    cache_efficient = config.attr(type=bool, default=False)
+    cvode = config.attr(type=CVodeSettings, default=None)
+    """Use variable time steps instead of the fixed ``resolution``."""
+    checkpoint_interval = config.attr(type=types.float(min=0.0), default=None)
+    """Time in ms between saves of the state of the simulation."""
+    checkpoint_directory = config.attr(type=str, default="checkpoints")
+    restore_from = config.attr(type=str, default=None)
+    """
+    Checkpoint to resume the simulation from. The network has to be prepared on the same
+    number of ranks as when it was saved.
+    """
+    seed = config.attr(type=types.int(min=0, max=2**32 - 1), default=0)
+    """Seed of the random streams of the simulation."""
+    profiling = config.attr(type=ProfilingSettings, default=None)
+    """Time the phases of the setup, and report them with the counts of each rank."""
+    coreneuron = config.attr(type=bool, default=False)
+    """
+    Solve the simulation with CoreNEURON. The mechanisms must be compiled for
+    CoreNEURON.
+    """
@@ -5,9 +5,10 @@ import unittest
 from copy import copy
 
 from arborize import define_model
-from bsb import Configuration
+from bsb import Branch, Configuration, Morphology, MorphologySet
 from bsb.services import MPI
 from bsb.simulation import get_simulation_adapter
+from bsb.storage.interfaces import StoredMorphology
 from bsb_test import (
     ConfigFixture,
     MorphologiesFixture,
@@ -15,7 +16,12 @@ from bsb_test import (
     RandomStorageFixture,
 )
 
-from bsb_neuron.cell import ArborizedModel, ArborizeModelTypeHandler
+from bsb_neuron.cell import (
+    ArborizedModel,
+    ArborizeModelTypeHandler,
+    _pack_morphology,
+    _unpack_morphology,
+)
 
 
 def neuron_installed():
@@ -82,3 +88,58 @@ class TestArborizedModel(
             new_cell_mdl._synapse_types["ExpSyn"].parameters,
             "Cell models synapses are not correctly converted to tree obj.",
         )
+
+    def test_parallel_schematics(self):
+        # Build the schematics of 2 different morphologies in a process pool.
+        self.network.simulations.test.schematic_workers = 2
+        model = self.network.simulations.test.cell_models.A
+        morphologies = [_soma_morphology(10, 1), _soma_morphology(20, 2)]
+        model.prepare_morphologies(morphologies)
+        self.assertEqual(2, model.schematic_cache_info().misses)
+        cell = model.create(0, None, morphologies[1], None, {})
+        self.assertEqual(1, len(cell.sections))
+        self.assertAlmostEqual(20, cell.sections[0].L)
+        self.assertEqual(1, model.schematic_cache_info().hits)
+
+    def test_shared_morphologies(self):
+        # A population with 3 different morphologies, in another order than their
+        # loaders, gets the morphology of its own loader in each cell.
+        lengths = [10, 20, 30]
+        loaders = [
+            StoredMorphology(f"m{length}", _loader(length), {}) for length in lengths
+        ]
+        indices = [2, 2, 0, 1, 2]
+        model = self.network.simulations.test.cell_models.A
+        morphologies = list(model._iter_morphologies(MorphologySet(loaders, indices)))
+        self.assertEqual(
+            [lengths[i] for i in indices],
+            [m.branches[0].points[-1, 1] for m in morphologies],
+        )
+        self.assertIs(morphologies[0], morphologies[4], "morphologies should be shared")
+
+
+class TestMorphologyPacking(unittest.TestCase):
+    def test_roundtrip(self):
+        root = Branch([[0, 0, 0], [0, 10, 0]], [1, 1])
+        root.label(["soma"])
+        child = Branch([[0, 10, 0], [5, 15, 0], [5, 20, 0]], [0.5, 0.5, 0.4])
+        child.label(["dendrites"], [1, 2])
+        root.attach_child(child)
+        morpho = Morphology([root], meta={"name": "test"})
+        copy = _unpack_morphology(_pack_morphology(morpho))
+        self.assertEqual(morpho, copy)
+        self.assertEqual({"name": "test"}, copy.meta)
+        self.assertEqual(
+            [list(map(set, b.labels.walk())) for b in morpho.branches],
+            [list(map(set, b.labels.walk())) for b in copy.branches],
+        )
+
+
+def _soma_morphology(length, radius):
+    soma = Branch([[0, 0, 0], [0, length, 0]], [radius, radius])
+    soma.label(["soma"])
+    return Morphology([soma])
+
+
+def _loader(length):
+    return lambda: _soma_morphology(length, 1)
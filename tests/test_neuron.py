@@ -1,10 +1,18 @@
+import gc
 import importlib
 import itertools
+import os
+import shutil
+import tempfile
 import traceback
 import unittest
+import warnings
 from copy import copy
+from unittest import mock
 
+import numpy as np
 from arborize import define_model
+from bsb import AdapterError, Branch, Morphology, SimulationError
 from bsb.core import Scaffold
 from bsb.services import MPI
 from bsb.simulation import get_simulation_adapter
@@ -16,14 +24,101 @@ from bsb_test import (
 )
 from patch import p
 
-from bsb_neuron.cell import ArborizedModel
-from bsb_neuron.connection import TransceiverModel
+from bsb_neuron.adapter import (
+    GIDMap,
+    NeuronAdapter,
+    NeuronPopulation,
+    _transmap_cache_path,
+    pack_locations,
+    unpack_locations,
+)
+from bsb_neuron.cell import ArborizedModel, Shim
+from bsb_neuron.connection import ConnectionData, GapJunctionModel, TransceiverModel
+from bsb_neuron.seeding import RandomStreams
 
 
 def neuron_installed():
     return importlib.util.find_spec("neuron")
 
 
+def neuron_clears_transfers():
+    # NEURON 8 crashes in parallel runs with the cache efficient memory layout, once the
+    # transfer of a previous network is cleared.
+    from neuron import __version__
+
+    return MPI.get_size() == 1 or int(__version__.split(".")[0]) >= 9
+
+
+def _remove_cache(path):
+    os.remove(path)
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        # Other ranks still have files in the directory
+        pass
+
+
+def _remove_directory(path):
+    MPI.barrier()
+    if MPI.get_rank() == 0:
+        shutil.rmtree(path)
+
+
+class TestGIDMap(unittest.TestCase):
+    def test_pack_roundtrip(self):
+        locs = np.array([[0, -1], [0, 0], [3, 2], [2**20, 7]])
+        keys = pack_locations(locs)
+        self.assertTrue(np.all(np.diff(keys) > 0), "packing should preserve order")
+        self.assertTrue(np.array_equal(locs, unpack_locations(keys)))
+
+    def test_lookup(self):
+        locs = np.array([[5, 0], [1, 2], [1, 0]])
+        gid_map = GIDMap(pack_locations(locs), [10, 11, 12])
+        self.assertTrue(np.array_equal([[1, 0], [1, 2], [5, 0]], gid_map.locations))
+        self.assertEqual(
+            [12, 10, 12], gid_map.lookup([[1, 0, 3], [5, 0, 0], [1, 0, 1]]).tolist()
+        )
+        with self.assertRaises(KeyError):
+            gid_map.lookup([[1, 1, 0]])
+        with self.assertRaises(KeyError):
+            GIDMap([], []).lookup([[1, 1, 0]])
+
+
+class TestNeuronPopulation(unittest.TestCase):
+    def setUp(self):
+        self.cells = [Shim() for _ in range(6)]
+        for cell, id in zip(self.cells, (10, 3, 7, 12, 5, 1)):
+            cell.id = id
+        self.pop = NeuronPopulation(None, self.cells)
+
+    def test_indexing(self):
+        mask = np.array([True, False, True, True, False, True])
+        view = self.pop[mask]
+        self.assertEqual([10, 7, 12, 1], [cell.id for cell in view])
+        self.assertEqual([10, 7, 12, 1], view.ids.tolist())
+        self.assertIs(self.cells[3], view[2])
+        self.assertIs(self.cells[5], view[np.int64(-1)])
+        self.assertEqual([12, 10], view[[2, 0]].ids.tolist())
+        self.assertEqual([7, 1], view[1::2].ids.tolist())
+        self.assertEqual([3, 12], self.pop[np.array([1, 3])].ids.tolist())
+        self.assertEqual(0, len(self.pop[[]]))
+        self.assertIs(self.cells[2], self.pop[2])
+        with self.assertRaises(SimulationError):
+            self.pop[mask[:3]]
+        with self.assertRaises(IndexError):
+            view[[4]]
+
+    def test_by_id(self):
+        self.assertIs(self.cells[4], self.pop.by_id(5))
+        self.assertEqual([12, 3, 5], self.pop.by_id([12, 3, 5]).ids.tolist())
+        view = self.pop[1:]
+        self.assertIs(self.cells[1], view.by_id(3))
+        with self.assertRaises(KeyError):
+            view.by_id(10)
+        with self.assertRaises(KeyError):
+            self.pop.by_id([1, 2])
+
+
 @unittest.skipIf(not neuron_installed(), "NEURON is not installed")
 class TestNeuronMinimal(
     RandomStorageFixture,
@@ -96,9 +191,9 @@ class TestNeuronMultichunk(
                 C=ArborizedModel(model=hh_soma),
             ),
             connection_models=dict(
-                A_to_B=TransceiverModel(synapses=[dict(synapse="ExpSyn")]),
-                B_to_C=TransceiverModel(synapses=[dict(synapse="ExpSyn")]),
-                C_to_A=TransceiverModel(synapses=[dict(synapse="ExpSyn")]),
+                A_to_B=TransceiverModel(synapses=[dict(synapse="ExpSyn", delay=1)]),
+                B_to_C=TransceiverModel(synapses=[dict(synapse="ExpSyn", delay=1)]),
+                C_to_A=TransceiverModel(synapses=[dict(synapse="ExpSyn", delay=1)]),
             ),
             devices=dict(),
         )
@@ -112,11 +207,13 @@ class TestNeuronMultichunk(
         sim = self.network.simulations.test
         adapter = get_simulation_adapter(sim.simulator)
         simdata = adapter.prepare(sim)
+        # The transmitter GIDs follow the GIDs of earlier simulations.
+        first = simdata.alloc[0]
         transmitting_cells = sorted(
             itertools.chain.from_iterable(
                 MPI.allgather(
                     [
-                        (model.name, cell.id, transmitter.gid)
+                        (model.name, cell.id, transmitter.gid - first)
                         for model, pop in simdata.populations.items()
                         for cell in pop
                         if (
@@ -130,7 +227,7 @@ class TestNeuronMultichunk(
             itertools.chain.from_iterable(
                 MPI.allgather(
                     [
-                        (model.name, cell.id, synapse.gid)
+                        (model.name, cell.id, synapse.gid - first)
                         for model, pop in simdata.populations.items()
                         for cell in pop
                         for synapse in getattr(cell.sections[0], "synapses", [])
@@ -172,6 +269,1028 @@ class TestNeuronMultichunk(
             ],
             receiving_cells,
         )
+        # Only the 7 transmitters get a GID, not each of the 12 connections.
+        self.assertEqual((first, first + 7), simdata.alloc)
+
+    def test_receivers(self):
+        """
+        Test that each synapse of a connection model is inserted for every incoming
+        connection, with the weight, delay and attributes resolved for it.
+        """
+        from neuron import h
+
+        sim = self.network.simulations.test
+        sim.connection_models.A_to_B.synapses = [
+            dict(
+                synapse="ExpSyn",
+                weight=0.01,
+                delay=dict(type="distance", intercept=1, slope=0.01),
+                attributes=dict(tau=3),
+            ),
+            dict(
+                synapse="ExpSyn",
+                weight=dict(
+                    type="distribution",
+                    distribution=dict(distribution="uniform", loc=0.02, scale=0.01),
+                ),
+                delay=2,
+            ),
+            dict(
+                synapse="ExpSyn",
+                weight=dict(type="expression", expression="0.04 + 0 * distance"),
+                delay=3,
+            ),
+        ]
+        adapter = get_simulation_adapter(sim.simulator)
+        simdata = adapter.prepare(sim)
+        synapses = {
+            synapse.__neuron__().hname()
+            for cell in simdata.populations[sim.cell_models.B]
+            for synapse in cell.sections[0].synapses
+        }
+        netcons = [
+            (nc.weight[0], nc.delay, nc.syn().tau)
+            for nc in h.List("NetCon")
+            if nc.syn() is not None and nc.syn().hname() in synapses
+        ]
+        self.assertEqual(15, sum(MPI.allgather(len(synapses))))
+        self.assertEqual(len(synapses), len(netcons))
+        n = len(netcons) // 3
+        by_distance = [nc for nc in netcons if nc[0] == 0.01]
+        self.assertEqual(n, len(by_distance))
+        self.assertTrue(all(tau == 3 for *_, tau in by_distance))
+        cs = self.network.get_connectivity_set("A_to_B")
+        pre, post = cs.load_connections().as_globals().all()
+        distances = np.linalg.norm(
+            self.network.get_placement_set("A").load_positions()[pre[:, 0]]
+            - self.network.get_placement_set("B").load_positions()[post[:, 0]],
+            axis=1,
+        )
+        self.assertTrue(
+            np.allclose(
+                np.sort(1 + 0.01 * distances),
+                np.sort(
+                    list(
+                        itertools.chain.from_iterable(
+                            MPI.allgather([delay for _, delay, _ in by_distance])
+                        )
+                    )
+                ),
+            )
+        )
+        self.assertEqual(
+            n, sum(0.02 <= w < 0.03 and d == 2 for w, d, _ in netcons), "distribution"
+        )
+        self.assertEqual(
+            n, sum(w == 0.04 and d == 3 for w, d, _ in netcons), "expression"
+        )
+
+    @unittest.skipIf(
+        not neuron_clears_transfers(), "NEURON can't clear transfers in parallel runs"
+    )
+    def test_gap_junctions(self):
+        """
+        Test that both sides of a gap junction receive the voltage of the other side.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 20
+        sim.connection_models["A_to_B"] = GapJunctionModel(
+            synapse="ExpSyn", variable="e", attributes=dict(tau=5)
+        )
+        sim.devices.add(
+            "clamp",
+            device="current_clamp",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+            amplitude=0.002,
+            before=0,
+            duration=20,
+        )
+        cs = self.network.get_connectivity_set("A_to_B")
+        # The voltages are counted from the stored connection counts.
+        with mock.patch.object(
+            type(cs), "__len__", side_effect=AssertionError("connections counted")
+        ):
+            count = sim.connection_models.A_to_B.count_source_ids(cs)
+        self.assertEqual(2 * len(cs), count)
+        adapter = get_simulation_adapter(sim.simulator)
+        simdata = adapter.prepare(sim)
+        adapter.run(sim)
+
+        def gaps(model):
+            return [
+                (float(cell.sections[0](0.5).v), float(gap._pp.e))
+                for cell in simdata.populations[sim.cell_models[model]]
+                for gap in cell.sections[0].synapses
+                if gap._pp.tau == 5
+            ]
+
+        a_gaps = list(itertools.chain.from_iterable(MPI.allgather(gaps("A"))))
+        b_gaps = list(itertools.chain.from_iterable(MPI.allgather(gaps("B"))))
+        self.assertEqual(len(cs), len(a_gaps))
+        self.assertEqual(len(a_gaps), len(b_gaps))
+        # Each side of a connection receives the voltage of the other side.
+        a_v, a_e = np.array(a_gaps).T
+        b_v, b_e = np.array(b_gaps).T
+        self.assertTrue(np.allclose(np.sort(a_e), np.sort(b_v)), "A side")
+        self.assertTrue(np.allclose(np.sort(b_e), np.sort(a_v)), "B side")
+        self.assertTrue(np.all(a_v > b_v.max()), "the clamp should depolarize A")
+
+    def test_setup_profile(self):
+        """
+        Test that the setup of each rank is timed and measured per phase and model, and
+        counted.
+        """
+        sim = self.network.simulations.test
+        directory = f"profiles_{self.id()}"
+        sim.profiling = {"cprofile_directory": directory}
+        sim.devices.add(
+            "vrec",
+            device="voltage_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+        )
+        adapter = get_simulation_adapter(sim.simulator)
+        simdata = adapter.prepare(sim)
+        self.addCleanup(_remove_directory, directory)
+        ranks = simdata.result.setup_profile
+        self.assertEqual(MPI.get_size(), len(ranks))
+        for phase in (
+            "load_balancing",
+            "create_neurons.A",
+            "allocate_transmitters",
+            "create_connections.A_to_B",
+            "create_devices.vrec",
+        ):
+            self.assertIn(phase, ranks[MPI.get_rank()]["timings"])
+            self.assertGreaterEqual(ranks[MPI.get_rank()]["memory"][phase], 0)
+        self.assertEqual(
+            len(self.network.get_placement_set("A"))
+            + len(self.network.get_placement_set("B"))
+            + len(self.network.get_placement_set("C")),
+            sum(rank["counts"]["cells"] for rank in ranks),
+        )
+        self.assertEqual(
+            len(self.network.get_connectivity_set("A_to_B"))
+            + len(self.network.get_connectivity_set("B_to_C"))
+            + len(self.network.get_connectivity_set("C_to_A")),
+            sum(rank["counts"]["synapses"] for rank in ranks),
+        )
+        self.assertTrue(
+            os.path.exists(os.path.join(directory, f"test_setup_{MPI.get_rank()}.prof"))
+        )
+
+    def test_connection_blocks(self):
+        """
+        Test that loading the connections in small blocks, or inserting the receivers 1
+        by 1, creates the same network.
+        """
+        from neuron import h
+
+        sim = self.network.simulations.test
+        sim.connection_models.A_to_B.synapses[0].weight = dict(
+            type="expression", expression="0.01 + 0.0001 * distance"
+        )
+
+        def connect(block_size):
+            p.parallel.gid_clear()
+            sim.connection_block_size = block_size
+            adapter = get_simulation_adapter(sim.simulator)
+            simdata = adapter.prepare(sim)
+            synapses = {
+                synapse.__neuron__().hname(): (model.name, cell.id, synapse.gid)
+                for model, pop in simdata.populations.items()
+                for cell in pop
+                for synapse in cell.sections[0].synapses
+            }
+            netcons = [
+                (synapses[nc.syn().hname()], nc.weight[0])
+                for nc in h.List("NetCon")
+                if nc.syn() is not None and nc.syn().hname() in synapses
+            ]
+            first = simdata.alloc[0]
+            return sorted(
+                itertools.chain.from_iterable(
+                    MPI.allgather(
+                        [
+                            (model, id, gid - first, weight)
+                            for (model, id, gid), weight in netcons
+                        ]
+                    )
+                )
+            )
+
+        reference = connect(1_000_000)
+        self.assertEqual(11, len(reference))
+        self.assertEqual(reference, connect(1))
+        # Cells that arborize didn't build receive their connections 1 by 1.
+        create_connections = NeuronAdapter.create_connections
+
+        def create_other_connections(adapter, simulation):
+            other = type("OtherModel", (), {})
+            with mock.patch("arborize.builders._neuron.NeuronModel", other):
+                create_connections(adapter, simulation)
+
+        with (
+            mock.patch.object(
+                NeuronAdapter, "create_connections", create_other_connections
+            ),
+            mock.patch("bsb_neuron.connection.insert_receivers") as batched,
+        ):
+            self.assertEqual(reference, connect(1_000_000))
+        batched.assert_not_called()
+
+    def test_transceiver_cache(self):
+        """
+        Test that the transceiver map is cached on disk and reused.
+        """
+        sim = self.network.simulations.test
+        sim.transceiver_cache = True
+        adapter = get_simulation_adapter(sim.simulator)
+        simdata = adapter.prepare(sim)
+        path = _transmap_cache_path(sim, simdata)
+        self.addCleanup(_remove_cache, path)
+        self.assertTrue(os.path.exists(path), "cache file should be written")
+        # The cache is found without counting the connections.
+        cs_type = type(next(iter(sim.get_connectivity_sets().values())))
+        with (
+            mock.patch.object(
+                adapter, "_map_transceivers", side_effect=AssertionError("cache miss")
+            ),
+            mock.patch.object(
+                cs_type, "__len__", side_effect=AssertionError("connections counted")
+            ),
+        ):
+            cached, count = adapter._get_transmap(sim, simdata)
+        first, last = simdata.alloc
+        self.assertEqual(last - first, count)
+        self.assertEqual(set(simdata.transmap.keys()), set(cached.keys()))
+        for cm, maps in simdata.transmap.items():
+            for kind, gid_map in maps.items():
+                self.assertTrue(np.array_equal(gid_map.keys, cached[cm][kind].keys))
+                self.assertTrue(
+                    np.array_equal(gid_map.gids, cached[cm][kind].gids + first)
+                )
+        # Connection models that stop spiking leave the transceiver map.
+        cm = next(iter(sim.connection_models.values()))
+        with mock.patch.object(cm, "spiking", False):
+            self.assertNotEqual(path, _transmap_cache_path(sim, simdata))
+
+    def test_streamed_recording(self):
+        """
+        Test that recorders drained to disk during the simulation flush the complete
+        signal.
+        """
+        sim = self.network.simulations.test
+        sim.flush_interval = 100
+        sim.duration = 250
+        adapter = get_simulation_adapter(sim.simulator)
+        simdata = adapter.prepare(sim)
+        simdata.result.record(p._ref_t, name="t")
+        for pop in simdata.populations.values():
+            for cell in pop:
+                simdata.result.record(cell.sections[0](0.5)._ref_v, name="v")
+        path = simdata.result._store.name
+        (result,) = adapter.run(sim)
+        self.assertTrue(os.path.getsize(path), "data should have been drained")
+        result.flush()
+        self.assertFalse(os.path.exists(path), "store should be cleaned up")
+        t, *vs = result.analogsignals
+        for v in vs:
+            self.assertEqual(2501, len(v))
+            self.assertAlmostEqual(-65, v[0].item())
+        self.assertTrue(
+            np.allclose(np.arange(0, 250.05, 0.1), t.magnitude.ravel()),
+            "time vector should be continuous",
+        )
+
+    def test_batched_recording(self):
+        """
+        Test that the signals recorded by a device are flushed as 1 multichannel signal.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 10
+        sim.devices.add(
+            "vrec",
+            device="voltage_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A", "B"]},
+        )
+        adapter = get_simulation_adapter(sim.simulator)
+        simdata = adapter.prepare(sim)
+        n_a = len(simdata.populations[sim.cell_models.A])
+        n_b = len(simdata.populations[sim.cell_models.B])
+        (result,) = adapter.run(sim)
+        result.flush()
+        (signal,) = result.analogsignals
+        self.assertEqual((101, n_a + n_b), signal.shape)
+        self.assertEqual("vrec", signal.name)
+        self.assertEqual(n_a + n_b, len(signal.array_annotations["cell_id"]))
+        cell_types = signal.array_annotations["cell_type"].tolist()
+        self.assertEqual(n_a, cell_types.count("A"))
+        self.assertEqual(n_b, cell_types.count("B"))
+
+    def test_device_locations(self):
+        """
+        Test that the locations of a device are resolved once per morphology.
+        """
+        sim = self.network.simulations.test
+        sim.devices.add(
+            "vrec",
+            device="voltage_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A", "B"]},
+        )
+        adapter = get_simulation_adapter(sim.simulator)
+        simdata = adapter.prepare(sim)
+        device = sim.devices.vrec
+        strategy = type(device.locations)
+        with mock.patch.object(
+            strategy, "get_locations", autospec=True, side_effect=strategy.get_locations
+        ) as get_locations:
+            pairs = list(device.iter_locations(adapter, sim, simdata))
+        cells = [
+            cell
+            for model in (sim.cell_models.A, sim.cell_models.B)
+            for cell in simdata.populations[model]
+        ]
+        self.assertEqual(len(cells), len(pairs))
+        for cell, (target, location) in zip(cells, pairs):
+            self.assertIs(cell, target)
+            self.assertIs(cell.locations[(0, 0)], location)
+        self.assertEqual(
+            len({id(cell.morphology) for cell in cells}), get_locations.call_count
+        )
+
+    def test_sampled_recording(self):
+        """
+        Test that recorders sample at their sampling interval, within their window.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 10
+        targetting = {"strategy": "cell_model", "cell_models": ["A"]}
+        sim.devices.add(
+            "sampled",
+            device="voltage_recorder",
+            targetting=targetting,
+            sampling_interval=1,
+        )
+        sim.devices.add(
+            "window",
+            device="voltage_recorder",
+            targetting=targetting,
+            sampling_interval=0.5,
+            start=2,
+            stop=4,
+        )
+        adapter = get_simulation_adapter(sim.simulator)
+        adapter.prepare(sim)
+        (result,) = adapter.run(sim)
+        result.flush()
+        signals = {signal.name: signal for signal in result.analogsignals}
+        sampled, window = signals["sampled"], signals["window"]
+        self.assertEqual(11, len(sampled))
+        self.assertEqual(1, float(sampled.sampling_period))
+        self.assertEqual(5, len(window))
+        self.assertEqual(2, float(window.t_start))
+        self.assertEqual(4, float(window.times[-1]))
+        self.assertTrue(np.all(np.isfinite(window.magnitude)))
+
+    def test_spike_recorder(self):
+        """
+        Test that the spike recorder records the spikes of cells with and without
+        transmitters.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 50
+        sim.devices.add(
+            "clamp",
+            device="current_clamp",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+            amplitude=1,
+            before=5,
+            duration=40,
+        )
+        sim.devices.add(
+            "spikes",
+            device="spike_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A", "C"]},
+        )
+        adapter = get_simulation_adapter(sim.simulator)
+        simdata = adapter.prepare(sim)
+        pop_a = simdata.populations[sim.cell_models.A]
+        n_c = len(simdata.populations[sim.cell_models.C])
+        (result,) = adapter.run(sim)
+        result.flush()
+        trains = result.spiketrains
+        self.assertEqual(len(pop_a) + n_c, len(trains))
+        spiking = set()
+        for train in trains:
+            self.assertEqual("spikes", train.name)
+            self.assertTrue(np.all(train.magnitude >= 5))
+            if train.annotations["cell_type"] == "A" and len(train):
+                spiking.add(train.annotations["cell_id"])
+        # Some A cells transmit to B and are recorded through their GID, the others
+        # through a spike detector.
+        self.assertEqual({cell.id for cell in pop_a}, spiking)
+
+    def test_spike_compress(self):
+        """
+        Test that compressed spike exchange delivers the same spikes.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 50
+        sim.devices.add(
+            "clamp",
+            device="current_clamp",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+            amplitude=1,
+            before=5,
+            duration=40,
+        )
+        sim.devices.add(
+            "spikes",
+            device="spike_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["B", "C"]},
+        )
+
+        def run(spike_compress):
+            p.parallel.gid_clear()
+            sim.spike_compress = spike_compress
+            adapter = get_simulation_adapter(sim.simulator)
+            adapter.prepare(sim)
+            (result,) = adapter.run(sim)
+            result.flush()
+            return {
+                (train.annotations["cell_type"], train.annotations["cell_id"]): list(
+                    train.magnitude
+                )
+                for train in result.spiketrains
+            }
+
+        reference = run(0)
+        self.assertTrue(any(reference.values()), "B and C cells should spike")
+        self.assertEqual(reference, run(10))
+
+    def test_spike_patterns(self):
+        """
+        Test that the spike generator plays patterns into the synapses from a source per
+        cell, or from a fixed number of sources.
+        """
+        from neuron import h
+
+        sim = self.network.simulations.test
+        sim.duration = 50
+        sim.devices.add(
+            "noise",
+            device="spike_generator",
+            targetting={"strategy": "cell_model", "cell_models": ["B"]},
+            synapses=["ExpSyn"],
+            pattern=dict(type="poisson", rate=200),
+            seed=42,
+            weight=0.1,
+            delay=1,
+        )
+        sim.devices.add(
+            "spikes",
+            device="spike_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["B"]},
+        )
+
+        def run(sources):
+            p.parallel.gid_clear()
+            sim.devices.noise.sources = sources
+            adapter = get_simulation_adapter(sim.simulator)
+            simdata = adapter.prepare(sim)
+            cells = simdata.populations[sim.cell_models.B]
+            synapses = {
+                synapse.__neuron__().hname(): cell.id
+                for cell in cells
+                for synapse in cell.sections[0].synapses
+            }
+            netcons = [
+                nc
+                for nc in h.List("NetCon")
+                if nc.syn() is not None
+                and nc.syn().hname() in synapses
+                and nc.pre() is not None
+            ]
+            self.assertEqual(len(synapses), len(netcons), "1 NetCon per synapse")
+            stims = {nc.pre().hname() for nc in netcons}
+            if sources is None:
+                self.assertEqual(len(set(synapses.values())), len(stims))
+            else:
+                self.assertLessEqual(len(stims), sources)
+            (result,) = adapter.run(sim)
+            result.flush()
+            return {
+                train.annotations["cell_id"]: list(train.magnitude)
+                for train in result.spiketrains
+            }
+
+        per_cell = run(None)
+        self.assertTrue(any(per_cell.values()), "B cells should spike")
+        self.assertEqual(per_cell, run(None), "patterns should be seeded")
+        run(2)
+
+    def test_spike_pattern_types(self):
+        """
+        Test that each type of pattern plays its spike trains, and that locations on the
+        same section connect each synapse once.
+        """
+        from neuron import h
+
+        sim = self.network.simulations.test
+        sim.duration = 20
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("1 3 5\n2 4\n")
+        self.addCleanup(os.unlink, f.name)
+        patterns = {
+            "poisson": (dict(type="poisson", rate=500, stop=10), None),
+            "regular": (
+                dict(type="regular", interval=2.5, start=1),
+                [[1, 3.5, 6, 8.5, 11, 13.5, 16, 18.5]],
+            ),
+            "file": (dict(type="file", path=f.name), [[1, 3, 5], [2, 4]]),
+        }
+        # Both points of the soma are on the same section.
+        sim.devices.add(
+            "noise",
+            device="spike_generator",
+            targetting={"strategy": "cell_model", "cell_models": ["B"]},
+            locations={"strategy": "label", "labels": ["soma"]},
+            synapses=["ExpSyn"],
+            pattern=dict(type="poisson", rate=1),
+            weight=0.1,
+            delay=1,
+        )
+        for name, (pattern, trains) in patterns.items():
+            with self.subTest(pattern=name):
+                p.parallel.gid_clear()
+                sim.devices.noise.pattern = pattern
+                adapter = get_simulation_adapter(sim.simulator)
+                simdata = adapter.prepare(sim)
+                cells = simdata.populations[sim.cell_models.B]
+                synapses = {
+                    synapse.__neuron__().hname()
+                    for cell in cells
+                    for synapse in cell.sections[0].synapses
+                }
+                netcons = [
+                    nc
+                    for nc in h.List("NetCon")
+                    if nc.syn() is not None
+                    and nc.syn().hname() in synapses
+                    and nc.pre() is not None
+                ]
+                self.assertEqual(len(synapses), len(netcons), "1 NetCon per synapse")
+                stims = {
+                    stim._vector.__neuron__().hname(): list(stim._vector)
+                    for cell in cells
+                    for synapse in cell.sections[0].synapses
+                    for stim in synapse._connections
+                }
+                for train in stims.values():
+                    if trains is None:
+                        self.assertTrue(all(0 <= t < 10 for t in train))
+                    else:
+                        self.assertIn(np.round(train, 6).tolist(), trains)
+                adapter.run(sim, keep_network=True)
+                self.assertFalse(
+                    any(
+                        synapse._connections
+                        for cell in cells
+                        for synapse in cell.sections[0].synapses
+                    ),
+                    "the teardown should disconnect all synapses",
+                )
+                adapter.simdata.pop(sim, None)
+
+    def test_random_streams(self):
+        """
+        Test that the random values of the network only depend on the seed, and not on
+        the ranks or the order in which they are drawn.
+        """
+        from neuron import h
+
+        sim = self.network.simulations.test
+        sim.duration = 50
+        sim.seed = 7
+        spec = dict(
+            synapse="ExpSyn",
+            weight=dict(
+                type="distribution",
+                distribution=dict(distribution="uniform", loc=0.02, scale=0.01),
+            ),
+            delay=1,
+        )
+        sim.connection_models.A_to_B.synapses = [spec]
+        sim.devices.add(
+            "noise",
+            device="spike_generator",
+            targetting={"strategy": "cell_model", "cell_models": ["B"]},
+            synapses=["ExpSyn"],
+            noise=1,
+            start=0,
+            interval=5,
+            number=10,
+            weight=0.1,
+            delay=1,
+        )
+        sim.devices.add(
+            "spikes",
+            device="spike_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["B"]},
+        )
+
+        def run():
+            p.parallel.gid_clear()
+            adapter = get_simulation_adapter(sim.simulator)
+            simdata = adapter.prepare(sim)
+            synapses = {
+                synapse.__neuron__().hname()
+                for cell in simdata.populations[sim.cell_models.B]
+                for synapse in cell.sections[0].synapses
+            }
+            weights = [
+                nc.weight[0]
+                for nc in h.List("NetCon")
+                if nc.syn() is not None
+                and nc.syn().hname() in synapses
+                and nc.pre() is None
+            ]
+            (result,) = adapter.run(sim)
+            result.flush()
+            spikes = {
+                train.annotations["cell_id"]: list(train.magnitude)
+                for train in result.spiketrains
+            }
+            return sorted(itertools.chain.from_iterable(MPI.allgather(weights))), spikes
+
+        weights, spikes = run()
+        cs = self.network.get_connectivity_set("A_to_B")
+        pre, post = cs.load_connections().as_globals().all()
+        expected = sim.connection_models.A_to_B.synapses[0].weight.resolve(
+            ConnectionData(cs, pre, post, streams=RandomStreams(7))
+        )
+        self.assertTrue(np.allclose(np.sort(expected), weights))
+        self.assertTrue(any(spikes.values()), "B cells should spike")
+        self.assertEqual((weights, spikes), run())
+        sim.seed = None
+        expected = sim.connection_models.A_to_B.synapses[0].weight.resolve(
+            ConnectionData(cs, pre, post, streams=RandomStreams(0))
+        )
+        self.assertTrue(
+            np.allclose(np.sort(expected), run()[0]), "unseeded runs should use seed 0"
+        )
+        streams = RandomStreams(7)
+        keys = np.arange(30).reshape(10, 3)
+        values = streams.uniform(sim, keys)
+        self.assertTrue(np.all((values >= 0) & (values < 1)))
+        self.assertTrue(np.array_equal(values[::-1], streams.uniform(sim, keys[::-1])))
+        self.assertFalse(np.array_equal(values, RandomStreams(8).uniform(sim, keys)))
+
+    def test_solver_intervals(self):
+        """
+        Test that the solver returns, reports progress and exchanges spikes at the
+        configured intervals.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 10
+        sim.psolve_interval = 0.5
+        sim.progress_interval = 2
+        sim.flush_interval = 3
+        sim.maxstep = 0.25
+        ticks = []
+        adapter = get_simulation_adapter(sim.simulator)
+        adapter.add_progress_listener(lambda sims, tick: ticks.append(tick.progression))
+        adapter.prepare(sim)
+        # NEURON counts its spike exchanges in a histogram of their number of spikes.
+        exchanges = p.Vector(1000)
+        p.parallel.max_histogram(exchanges.__neuron__())
+        self.addCleanup(p.parallel.max_histogram)
+        with (
+            mock.patch.object(p.parallel, "psolve", wraps=p.parallel.psolve) as psolve,
+            mock.patch("bsb_neuron.adapter.report") as report,
+        ):
+            (result,) = adapter.run(sim)
+        result.flush()
+        self.assertEqual(20, psolve.call_count)
+        self.assertEqual([2, 4, 6, 8, 10], [float(t) for t in ticks])
+        report.assert_any_call("Exchanging spikes every 0.25ms", level=3)
+        if MPI.get_size() > 1:
+            # Without other ranks to exchange spikes with, NEURON doesn't exchange them.
+            self.assertGreaterEqual(sum(exchanges), sim.duration / sim.maxstep)
+
+    def test_exchange_interval(self):
+        """
+        Test that spikes are exchanged at the minimum delay of the network.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 60
+        sim.psolve_interval = None
+        for model in sim.connection_models.values():
+            model.synapses[0].delay = 20
+        adapter = get_simulation_adapter(sim.simulator)
+        adapter.prepare(sim)
+        exchanges = p.Vector(1000)
+        p.parallel.max_histogram(exchanges.__neuron__())
+        self.addCleanup(p.parallel.max_histogram)
+        with mock.patch("bsb_neuron.adapter.report") as report:
+            adapter.run(sim)
+        # Without other ranks to exchange spikes with, NEURON ignores the delays.
+        interval = 20.0 if MPI.get_size() > 1 else sim.duration
+        report.assert_any_call(f"Exchanging spikes every {interval}ms", level=3)
+        if MPI.get_size() > 1:
+            # Once at the start, and then every 20ms, instead of the 10ms of patch.
+            self.assertEqual(sim.duration / 20 + 1, sum(exchanges))
+
+    def test_threads_and_cvode(self):
+        """
+        Test that multithreaded and variable time step runs reproduce the single
+        threaded fixed step run.
+        """
+        # C cells get a dendrite, NEURON only partitions the root sections of cells.
+        if not MPI.get_rank():
+            soma = Branch([[0, 0, 0], [0, 1, 0]], [1, 1])
+            dendrite = Branch([[0, 1, 0], [0, 20, 0]], [0.5, 0.5])
+            soma.label(["soma"])
+            dendrite.label(["soma"])
+            soma.attach_child(dendrite)
+            self.network.morphologies.save("2branch", Morphology([soma]))
+        MPI.barrier()
+        self.network.cell_types.C.spatial.morphologies = ["2branch"]
+        self.network.clear_placement()
+        self.network.clear_connectivity()
+        self.network.compile(append=True)
+        sim = self.network.simulations.test
+        sim.duration = 20
+        sim.devices.add(
+            "clamp",
+            device="current_clamp",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+            amplitude=0.02,
+            before=5,
+            duration=10,
+        )
+        sim.devices.add(
+            "vrec",
+            device="voltage_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A", "B"]},
+        )
+
+        def run(**settings):
+            p.parallel.gid_clear()
+            for key, value in settings.items():
+                setattr(sim, key, value)
+            adapter = get_simulation_adapter(sim.simulator)
+            adapter.prepare(sim)
+            (result,) = adapter.run(sim)
+            result.flush()
+            (signal,) = [s for s in result.analogsignals if s.name == "vrec"]
+            return signal.magnitude
+
+        reference = run()
+        threaded = run(threads=2, thread_partitioning="balanced", cache_efficient=True)
+        self.assertEqual(2, p.parallel.nthread())
+        self.assertTrue(np.allclose(reference, threaded))
+        # The variable step recordings may miss the sample at the end of the run.
+        for local in (False, True):
+            variable = run(threads=1, cvode={"local": local, "atol": 1e-4})
+            self.assertGreaterEqual(len(variable), len(reference) - 1)
+            # Spike onsets shift a little, but the rest of the trace should match.
+            error = np.abs(reference[: len(variable)] - variable)
+            self.assertLess(np.median(error), 0.1)
+        run(cvode=None)
+        self.assertFalse(p.CVode().active())
+        # Runs that can't be initialized on several threads fall back to 1 thread, other
+        # errors are raised.
+        finitialize = NeuronAdapter._finitialize
+
+        def single_threaded(adapter, pc, maxstep):
+            if pc.nthread() > 1:
+                raise RuntimeError("hocobj_call error")
+            return finitialize(adapter, pc, maxstep)
+
+        with mock.patch.object(NeuronAdapter, "_finitialize", single_threaded):
+            with self.assertWarns(Warning):
+                fallback = run(threads=2, cvode=None)
+        self.assertEqual(1, p.parallel.nthread())
+        self.assertTrue(np.allclose(reference, fallback))
+        with (
+            mock.patch.object(
+                NeuronAdapter,
+                "_finitialize",
+                side_effect=RuntimeError("hocobj_call error"),
+            ),
+            warnings.catch_warnings(record=True) as caught,
+            self.assertRaises(RuntimeError),
+        ):
+            run(threads=2)
+        self.assertFalse([w for w in caught if "thread" in str(w.message)])
+
+    def test_coreneuron(self):
+        """
+        Test that CoreNEURON runs reproduce the recordings of NEURON runs.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 50
+        sim.devices.add(
+            "clamp",
+            device="current_clamp",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+            amplitude=0.02,
+            before=5,
+            duration=40,
+        )
+        sim.devices.add(
+            "vrec",
+            device="voltage_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A", "B"]},
+            sampling_interval=0.5,
+            start=10,
+        )
+        sim.devices.add(
+            "spikes",
+            device="spike_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A", "B", "C"]},
+        )
+
+        def run(coreneuron):
+            p.parallel.gid_clear()
+            sim.coreneuron = coreneuron
+            adapter = get_simulation_adapter(sim.simulator)
+            adapter.prepare(sim)
+            (result,) = adapter.run(sim)
+            result.flush()
+            (signal,) = [s for s in result.analogsignals if s.name == "vrec"]
+            spikes = {
+                (t.annotations["cell_type"], t.annotations["cell_id"]): t.magnitude
+                for t in result.spiketrains
+            }
+            return signal, spikes
+
+        signal, spikes = run(False)
+        core_signal, core_spikes = run(True)
+        self.assertEqual(10, float(core_signal.t_start))
+        self.assertEqual(0.5, float(core_signal.sampling_period))
+        # NEURON doesn't record the sample at the end of the run, CoreNEURON does.
+        self.assertEqual(len(signal) + 1, len(core_signal))
+        self.assertTrue(np.allclose(signal.magnitude, core_signal.magnitude[:-1]))
+        self.assertEqual(spikes.keys(), core_spikes.keys())
+        for key, train in spikes.items():
+            self.assertTrue(np.allclose(train, core_spikes[key]), f"{key} spikes differ")
+
+    def test_rerun(self):
+        """
+        Test that a kept network can be run again with other devices, without
+        building it again.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 50
+        sim.profiling = {}
+        sim.devices.add(
+            "clamp",
+            device="current_clamp",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+            amplitude=0.02,
+            before=5,
+            duration=40,
+        )
+        sim.devices.add(
+            "spikes",
+            device="spike_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+        )
+        adapter = get_simulation_adapter(sim.simulator)
+        adapter.prepare(sim)
+        (clamped,) = adapter.run(sim, keep_network=True)
+        del sim.devices["clamp"]
+        sim.devices.add(
+            "vrec",
+            device="voltage_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+        )
+        with mock.patch.object(adapter, "create_neurons") as create_neurons:
+            (unclamped,) = adapter.rerun(sim)
+        create_neurons.assert_not_called()
+        self.assertNotIn(sim, adapter.simdata)
+        self.assertIsNotNone(clamped.setup_profile)
+        self.assertEqual(clamped.setup_profile, unclamped.setup_profile)
+        clamped.flush()
+        unclamped.flush()
+        self.assertTrue(all(len(train) for train in clamped.spiketrains))
+        self.assertFalse(any(len(train) for train in unclamped.spiketrains))
+        (signal,) = unclamped.analogsignals
+        self.assertLess(signal.magnitude.max(), -60, "the clamp should be removed")
+        with self.assertRaises(AdapterError):
+            adapter.rerun(sim)
+
+    def test_rerun_voltage_clamp(self):
+        """
+        Test that a voltage clamp is removed from a kept network.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 20
+        sim.devices.add(
+            "clamp",
+            device="vclamp",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+            voltage=-20,
+            duration=20,
+        )
+        sim.devices.add(
+            "vrec",
+            device="voltage_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+        )
+        adapter = get_simulation_adapter(sim.simulator)
+        adapter.prepare(sim)
+        (clamped,) = adapter.run(sim, keep_network=True)
+        del sim.devices["clamp"]
+        (unclamped,) = adapter.rerun(sim)
+        clamped.flush()
+        unclamped.flush()
+        (signal,) = (s for s in clamped.analogsignals if s.name == "vrec")
+        self.assertGreater(signal.magnitude[-1].min(), -30, "the clamp should hold A")
+        (signal,) = unclamped.analogsignals
+        self.assertLess(signal.magnitude.max(), -60, "the clamp should be removed")
+
+    def test_checkpoint(self):
+        """
+        Test that a simulation resumed from a checkpoint continues like the original.
+        """
+        sim = self.network.simulations.test
+        sim.duration = 50
+        sim.checkpoint_interval = 5
+        sim.checkpoint_directory = f"checkpoints_{self.id()}"
+        self.addCleanup(_remove_directory, sim.checkpoint_directory)
+        sim.devices.add(
+            "clamp",
+            device="current_clamp",
+            targetting={"strategy": "cell_model", "cell_models": ["A"]},
+            amplitude=0.02,
+            before=5,
+            duration=40,
+        )
+        sim.devices.add(
+            "vrec",
+            device="voltage_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A", "B"]},
+        )
+        sim.devices.add(
+            "spikes",
+            device="spike_recorder",
+            targetting={"strategy": "cell_model", "cell_models": ["A", "B", "C"]},
+        )
+
+        def run():
+            # Restored networks must be identical, so free any other network first.
+            adapter = get_simulation_adapter(sim.simulator)
+            adapter.simdata.clear()
+            gc.collect()
+            p.parallel.gid_clear()
+            adapter.prepare(sim)
+            (result,) = adapter.run(sim)
+            result.flush()
+            (signal,) = [s for s in result.analogsignals if s.name == "vrec"]
+            return signal, [train.magnitude for train in result.spiketrains]
+
+        signal, trains = run()
+        # Restore just before the clamp makes the cells spike.
+        checkpoint = os.path.join(sim.checkpoint_directory, "test_5ms")
+        self.assertTrue(os.path.exists(os.path.join(checkpoint, "checkpoint.json")))
+        self.assertTrue(
+            os.path.isdir(os.path.join(sim.checkpoint_directory, "test_45ms"))
+        )
+        sim.checkpoint_interval = None
+        sim.restore_from = checkpoint
+        restored, restored_trains = run()
+        self.assertAlmostEqual(5, float(restored.t_start))
+        self.assertTrue(np.allclose(signal.magnitude[50:], restored.magnitude))
+        self.assertTrue(any(len(train) for train in restored_trains))
+        for train, restored_train in zip(trains, restored_trains):
+            self.assertTrue(np.allclose(train[train > 5], restored_train))
+        sim.restore_from = "does_not_exist"
+        with self.assertRaises(SimulationError):
+            run()
+        # Free the network held by the traceback, instead of during the next test.
+        gc.collect()
+
+    def test_greedy_balancing(self):
+        """
+        Test that the greedy load balancer assigns every chunk exactly once, and
+        keeps the imbalance under the cost of the most expensive chunk.
+        """
+        sim = self.network.simulations.test
+        sim.load_balancing = dict(strategy="greedy")
+        all_chunks = sim.load_balancing.get_chunks(sim)
+        costs = sim.load_balancing.estimate_costs(sim, all_chunks)
+        for size in (1, 2, 3, 4):
+            alloc, loads = sim.load_balancing.allocate(sim, size)
+            self.assertEqual(size, len(alloc))
+            self.assertEqual(
+                sorted(all_chunks), sorted(itertools.chain.from_iterable(alloc))
+            )
+            self.assertEqual(len(all_chunks), sum(map(len, alloc)))
+            self.assertAlmostEqual(sum(costs), sum(loads))
+            self.assertLessEqual(max(loads) - min(loads), max(costs))
 
 
 @unittest.skipIf(not neuron_installed(), "NEURON is not installed")
@@ -228,11 +1347,12 @@ class TestNeuronSmallChunk(
         sim = self.network.simulations.test
         adapter = get_simulation_adapter(sim.simulator)
         simdata = adapter.prepare(sim)
+        first = simdata.alloc[0]
         transmitting_cells = sorted(
             itertools.chain.from_iterable(
                 MPI.allgather(
                     [
-                        (model.name, cell.id, transmitter.gid)
+                        (model.name, cell.id, transmitter.gid - first)
                         for model, pop in simdata.populations.items()
                         for cell in pop
                         if (
@@ -246,7 +1366,7 @@ class TestNeuronSmallChunk(
             itertools.chain.from_iterable(
                 MPI.allgather(
                     [
-                        (model.name, cell.id, synapse.gid)
+                        (model.name, cell.id, synapse.gid - first)
                         for model, pop in simdata.populations.items()
                         for cell in pop
                         for synapse in getattr(cell.sections[0], "synapses", [])
@@ -343,11 +1463,12 @@ class TestNeuronMultiBranch(
         sim = self.network.simulations.test
         adapter = get_simulation_adapter(sim.simulator)
         simdata = adapter.prepare(sim)
+        first = simdata.alloc[0]
         transmitting_cells = sorted(
             itertools.chain.from_iterable(
                 MPI.allgather(
                     [
-                        (model.name, cell.id, i_sec, transmitter.gid)
+                        (model.name, cell.id, i_sec, transmitter.gid - first)
                         for model, pop in simdata.populations.items()
                         for cell in pop
                         for i_sec, sec_i in enumerate(cell.sections)
@@ -364,7 +1485,7 @@ class TestNeuronMultiBranch(
             itertools.chain.from_iterable(
                 MPI.allgather(
                     [
-                        (model.name, cell.id, i_sec, synapse.gid)
+                        (model.name, cell.id, i_sec, synapse.gid - first)
                         for model, pop in simdata.populations.items()
                         for cell in pop
                         for i_sec, sec_i in enumerate(cell.sections)
@@ -373,6 +1494,10 @@ class TestNeuronMultiBranch(
                 )
             )
         )
+        for model, pop in simdata.populations.items():
+            info = model.schematic_cache_info()
+            self.assertEqual(len(pop), info.hits + info.misses)
+            self.assertLessEqual(info.misses, 1, "morphology should be built once")
         self.assertEqual(
             [
                 # A
@@ -464,11 +1589,12 @@ class TestNeuronMultiBranchLoop(
         sim = self.network.simulations.test
         adapter = get_simulation_adapter(sim.simulator)
         simdata = adapter.prepare(sim)
+        first = simdata.alloc[0]
         transmitting_cells = sorted(
             itertools.chain.from_iterable(
                 MPI.allgather(
                     [
-                        (model.name, cell.id, i_sec, transmitter.gid)
+                        (model.name, cell.id, i_sec, transmitter.gid - first)
                         for model, pop in simdata.populations.items()
                         for cell in pop
                         for i_sec, sec_i in enumerate(cell.sections)
@@ -485,7 +1611,7 @@ class TestNeuronMultiBranchLoop(
             itertools.chain.from_iterable(
                 MPI.allgather(
                     [
-                        (model.name, cell.id, i_sec, synapse.gid)
+                        (model.name, cell.id, i_sec, synapse.gid - first)
                         for model, pop in simdata.populations.items()
                         for cell in pop
                         for i_sec, sec_i in enumerate(cell.sections)